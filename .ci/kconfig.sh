@@ -14,4 +14,7 @@ fi
 
 export PYTHONUNBUFFERED=1
 
+# Check kernels in parallel with all CPU cores
+export PMAPORTS_CI_JOBS="${PMAPORTS_CI_JOBS:-auto}"
+
 .ci/lib/check_changed_kernels.py
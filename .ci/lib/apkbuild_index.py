@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Index of all APKBUILDs in pmaports, so each one only gets parsed once no
+# matter how many checks look at it.
+
+import glob
+import logging
+import os
+
+# Same dir
+import instrumentation
+import parallel
+
+# pmbootstrap
+import add_pmbootstrap_to_import_path  # noqa
+import pmb.config
+import pmb.helpers.logging
+import pmb.parse
+import pmb.parse._apkbuild
+import pmb.parse.version
+
+# Packages with subpackages that the APKBUILD parser can't see, as they get
+# defined in a loop or only for some CARCH. Names like "<pkgname>-*" that no
+# package provides belong to them.
+hidden_subpackages = [
+    "firmware-qcom-adreno",
+    "lk2nd",
+]
+
+
+def get_depend_name(depend):
+    """ Strip version constraints and conflicts from a dependency.
+
+        :param depend: entry of depends, makedepends or provides, e.g.
+                       "!foo", "bar>=1.0" or "so:libbaz.so.1=1.2"
+        :returns: the name, e.g. "foo", "bar" or "so:libbaz.so.1" """
+    depend = depend.lstrip("!")
+    for operator in "<>=~":
+        depend = depend.split(operator, 1)[0]
+    return depend
+
+
+def get_hidden_subpackage_parent(name):
+    """ :param name: name that no package provides, e.g. "lk2nd-msm8226"
+        :returns: pkgname from hidden_subpackages that defines it, e.g.
+                  "lk2nd", or None """
+    for pkgname in hidden_subpackages:
+        if name.startswith(f"{pkgname}-"):
+            return pkgname
+    return None
+
+
+def parse_text(content, path, check_pkgver=True, check_pkgname=True):
+    """ Parse an APKBUILD from memory, like pmb.parse.apkbuild() does from a
+        file. Used for APKBUILDs read from git revisions, so they don't need
+        to be written to a temporary file first. The result does not end up in
+        pmbootstrap's APKBUILD cache, as the path doesn't exist on disk.
+
+        :param content: contents of the APKBUILD as str or bytes
+        :param path: virtual path of the APKBUILD, only used for the pkgname
+                     check and in error messages, e.g.
+                     "upstream/master:main/hello-world/APKBUILD"
+        :param check_pkgver: verify that the pkgver is valid
+        :param check_pkgname: the pkgname must match the name of the folder
+                              in path
+        :returns: parsed APKBUILD (see pmb.parse.apkbuild()) """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    if "\r" in content:
+        raise RuntimeError(f"Wrong line endings in APKBUILD: {path}")
+    lines = content.splitlines(keepends=True)
+
+    # The parser logs with logging.verbose(), which pmbootstrap only adds
+    # when initializing its logging (not done by standalone CI scripts)
+    if not hasattr(logging, "verbose"):
+        pmb.helpers.logging.add_verbose_log_level()
+
+    ret = dict.fromkeys(pmb.config.apkbuild_attributes, "")
+    with instrumentation.measure("parse", "APKBUILD (git)"):
+        pmb.parse._apkbuild._parse_attributes(
+            path, lines, pmb.config.apkbuild_attributes, ret)
+
+    if check_pkgname and not path.endswith(f"/{ret['pkgname']}/APKBUILD"):
+        raise RuntimeError("The pkgname must be equal to the name of the"
+                           f" folder that contains the APKBUILD: {path}")
+    if check_pkgver and not pmb.parse.version.validate(ret["pkgver"]):
+        raise RuntimeError(f"Invalid pkgver '{ret['pkgver']}' in APKBUILD:"
+                           f" {path}")
+    return ret
+
+
+def parse_or_error(path):
+    """ Parse an APKBUILD in a worker process of ApkbuildIndex.parse_all().
+        Parse errors get returned instead of raised, so one broken APKBUILD
+        doesn't stop the others. They get raised again when a testcase tries
+        to parse it with ApkbuildIndex.get().
+
+        :returns: (parsed APKBUILD, None) or (None, error string) """
+    try:
+        return pmb.parse.apkbuild(path), None
+    except (RuntimeError, ValueError) as e:
+        return None, str(e)
+
+
+class ApkbuildIndex:
+    """ All APKBUILDs of a pmaports dir, keyed by path and pkgname. Each
+        APKBUILD gets parsed with pmb.parse.apkbuild() on first access and the
+        result is kept for the lifetime of the index. """
+
+    def __init__(self, pmaports_dir, cache=None):
+        """ :param pmaports_dir: full path to the pmaports dir
+            :param cache: optional persistent_cache.ParseCache, to reuse parse
+                          results from previous runs """
+        self.pmaports_dir = pmaports_dir
+        self.cache = cache
+        self.parsed = {}
+
+        # Relative package dir => error string, for APKBUILDs that failed to
+        # parse in parse_all() or get_all()
+        self.errors = {}
+
+        # Package dirs that select() returns by default, None for all. Set
+        # with restrict().
+        self.restricted = None
+
+        # Relative paths to the package dirs, e.g. "main/hello-world". Sorted,
+        # so everything iterating over the index gets a stable order.
+        with instrumentation.measure("walk", "glob **/APKBUILD"):
+            self.package_dirs = sorted(
+                os.path.relpath(os.path.dirname(path), pmaports_dir)
+                for path in glob.iglob(f"{pmaports_dir}/**/APKBUILD",
+                                       recursive=True))
+
+        # The package dir name is the pkgname (pmb.parse.apkbuild() verifies
+        # that when parsing)
+        self.package_dirs_by_pkgname = {}
+        for package_dir in self.package_dirs:
+            pkgname = os.path.basename(package_dir)
+            self.package_dirs_by_pkgname[pkgname] = package_dir
+
+    def path(self, package_dir):
+        """ :param package_dir: relative package dir, e.g. "main/hello-world"
+            :returns: full path to the APKBUILD """
+        return f"{self.pmaports_dir}/{package_dir}/APKBUILD"
+
+    def parse(self, package_dir):
+        """ :returns: APKBUILD parsed with pmb.parse.apkbuild(), without
+                      looking at the index or the cache """
+        with instrumentation.measure("parse", "APKBUILD"):
+            return pmb.parse.apkbuild(self.path(package_dir))
+
+    def get(self, package_dir):
+        """ :param package_dir: relative package dir, e.g. "main/hello-world"
+            :returns: parsed APKBUILD (see pmb.parse.apkbuild()) """
+        if package_dir not in self.parsed:
+            if self.cache:
+                self.parsed[package_dir] = self.cache.get(
+                    "apkbuild", [f"{package_dir}/APKBUILD"],
+                    lambda: self.parse(package_dir))
+            else:
+                self.parsed[package_dir] = self.parse(package_dir)
+        return self.parsed[package_dir]
+
+    def parse_all(self, jobs=None):
+        """ Parse all APKBUILDs that are not parsed yet (and not in the
+            cache) in parallel.
+
+            :param jobs: see parallel.get_jobs() """
+        missing = []
+        for package_dir in self.package_dirs:
+            if package_dir in self.parsed:
+                continue
+            if self.cache:
+                key = self.cache.key([f"{package_dir}/APKBUILD"])
+                parsed = self.cache.lookup("apkbuild", key)
+                if parsed is not None:
+                    self.parsed[package_dir] = parsed
+                    continue
+            missing.append(package_dir)
+
+        paths = [self.path(package_dir) for package_dir in missing]
+        with instrumentation.measure("parse", "APKBUILD (parse_all)",
+                                     len(paths)):
+            results = parallel.map_ordered(parse_or_error, paths, jobs=jobs)
+        for package_dir, (parsed, error) in zip(missing, results):
+            if error is not None:
+                self.errors[package_dir] = error
+                continue
+            self.parsed[package_dir] = parsed
+            if self.cache:
+                key = self.cache.key([f"{package_dir}/APKBUILD"])
+                self.cache.store("apkbuild", key, parsed)
+
+    def get_by_pkgname(self, pkgname):
+        """ :returns: parsed APKBUILD, or None if the package doesn't exist """
+        package_dir = self.package_dirs_by_pkgname.get(pkgname)
+        if not package_dir:
+            return None
+        return self.get(package_dir)
+
+    @property
+    def categories(self):
+        """ :returns: sorted list of dirs that contain packages, e.g.
+                      ["cross", "device/community", ..., "temp"] """
+        return sorted({os.path.dirname(d) for d in self.package_dirs})
+
+    def get_all(self):
+        """ :returns: dict of relative package dir => parsed APKBUILD, for all
+                      packages that can be parsed. The others end up in
+                      self.errors. """
+        ret = {}
+        for package_dir in self.package_dirs:
+            try:
+                ret[package_dir] = self.get(package_dir)
+            except (RuntimeError, ValueError) as e:
+                self.errors[package_dir] = str(e)
+        return ret
+
+    def restrict(self, package_dirs):
+        """ Only return the given packages from select() and iter() by
+            default (used for incremental runs).
+
+            :param package_dirs: relative package dirs, or None to select all
+                                 packages again """
+        if package_dirs is not None:
+            package_dirs = set(package_dirs)
+        self.restricted = package_dirs
+
+    def select(self, category=None, prefix=None, restricted=True):
+        """ Get relative package dirs matching the given filters.
+
+            :param category: only packages directly in this dir (e.g. "main",
+                             "device/community"), or in one of the dirs if a
+                             list is given. None for all categories.
+            :param prefix: only packages with a dir name that starts with
+                           this prefix (e.g. "linux-")
+            :param restricted: only packages passed to restrict(), if it was
+                               called. Set to False for checks that need to
+                               look at the whole tree.
+            :returns: list of relative package dirs """
+        if isinstance(category, str):
+            category = [category]
+
+        ret = []
+        for package_dir in self.package_dirs:
+            if restricted and self.restricted is not None and \
+                    package_dir not in self.restricted:
+                continue
+            dirname, pkgname = os.path.split(package_dir)
+            if category is not None and dirname not in category:
+                continue
+            if prefix and not pkgname.startswith(prefix):
+                continue
+            ret.append(package_dir)
+        return ret
+
+    def iter(self, category=None, prefix=None, restricted=True):
+        """ Iterate over parsed APKBUILDs, see select() for the parameters.
+
+            :returns: iterator of (path, apkbuild), where path is the full
+                      path to the APKBUILD """
+        for package_dir in self.select(category, prefix, restricted):
+            yield self.path(package_dir), self.get(package_dir)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Find out once per pipeline which of the changed packages get built for
+# which architecture, so the build-{arch} jobs don't have to parse the same
+# APKBUILDs again. The matrix is a text file with one line per architecture,
+# so build-{arch}.sh can read it with grep before installing pmbootstrap and
+# skip the job if there is nothing to build. build_changed_aports.py takes
+# the packages to build from it:
+#
+#   aarch64 hello-world linux-postmarketos-qcom-sdm845
+#   armhf hello-world
+#   ...
+#
+# arch_matrix.py OUTPUT
+#   Write the matrix for the packages changed in this branch to OUTPUT.
+
+import sys
+
+# Same dir
+import apkbuild_index
+import common
+import revdep_index
+
+# pmbootstrap
+import add_pmbootstrap_to_import_path  # noqa
+import pmb.config
+import pmb.helpers.pmaports
+
+
+def parse_apkbuilds(packages):
+    """ :param packages: pkgnames of packages in pmaports
+        :returns: dict of pkgname => parsed APKBUILD """
+    paths = common.get_apkbuild_paths()
+    pmaports_dir = common.get_pmaports_dir()
+    ret = {}
+    for package in packages:
+        if package not in paths:
+            raise RuntimeError(f"Could not find aport for package: {package}")
+        path = f"{pmaports_dir}/{paths[package]}"
+        with open(path, "rb") as handle:
+            ret[package] = apkbuild_index.parse_text(handle.read(), path)
+    return ret
+
+
+def filter_arch(apkbuilds, arch):
+    """ :param apkbuilds: see parse_apkbuilds()
+        :param arch: architecture to build for
+        :returns: list of pkgnames that can be built for arch """
+    return [pkgname for pkgname, apkbuild in apkbuilds.items()
+            if pmb.helpers.pmaports.check_arches(apkbuild["arch"], arch)]
+
+
+def generate(packages, verify_only=False):
+    """ :param packages: changed pkgnames
+        :param verify_only: set with [ci:skip-build], then only the
+                            build-x86_64 job runs and verifies the checksums
+                            of all changed packages (see
+                            build_changed_aports.py)
+        :returns: dict of arch => list of pkgnames """
+    if verify_only:
+        return {arch: list(packages) if arch == "x86_64" else []
+                for arch in pmb.config.build_device_architectures}
+
+    apkbuilds = parse_apkbuilds(packages)
+    return {arch: filter_arch(apkbuilds, arch)
+            for arch in pmb.config.build_device_architectures}
+
+
+def write(matrix, path):
+    with open(path, "w") as handle:
+        for arch, pkgnames in sorted(matrix.items()):
+            handle.write(" ".join([arch] + pkgnames) + "\n")
+
+
+def read(path, arch):
+    """ :param path: matrix written by write()
+        :param arch: architecture to build for
+        :returns: list of pkgnames to build for arch, or None if the matrix
+                  has no line for it """
+    with open(path) as handle:
+        for line in handle:
+            words = line.split()
+            if words and words[0] == arch:
+                return words[1:]
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(f"usage: {sys.argv[0]} OUTPUT")
+        sys.exit(1)
+
+    common.add_upstream_git_remote()
+    packages = common.get_changed_packages()
+    verify_only = common.commit_message_has_string("[ci:skip-build]")
+    if not verify_only:
+        packages = revdep_index.get_packages_to_build(packages)
+    matrix = generate(packages, verify_only)
+    write(matrix, sys.argv[1])
+    for arch, pkgnames in sorted(matrix.items()):
+        print(f"{arch}: {', '.join(pkgnames) or '(nothing to build)'}")
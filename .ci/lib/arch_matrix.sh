@@ -0,0 +1,18 @@
+#!/bin/sh -e
+# SPDX-License-Identifier: GPL-3.0-or-later
+# Write arch_matrix.txt with the changed packages per architecture, for the
+# build-{arch} jobs (see arch_matrix.py)
+
+if [ "$(id -u)" = 0 ]; then
+	set -x
+	wget "https://gitlab.com/postmarketOS/ci-common/-/raw/master/install_pmbootstrap.sh"
+	sh ./install_pmbootstrap.sh
+	touch arch_matrix.txt
+	chown "${TESTUSER:-pmos}" arch_matrix.txt
+	exec su "${TESTUSER:-pmos}" -c "sh -e $0"
+fi
+
+export PYTHONUNBUFFERED=1
+
+set -x
+.ci/lib/arch_matrix.py arch_matrix.txt
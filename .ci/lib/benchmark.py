@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Measure how the CI scripts scale with the size of pmaports. For each size,
+# a synthetic tree gets generated (see synthetic_tree.py) and each benchmark
+# case runs in a new process in that tree, so nothing is cached between the
+# runs. Functions (e.g. common.get_changed_files) are timed inside the
+# process, scripts (e.g. grep_rules.py) including the interpreter startup.
+#
+# The results are stored as JSON, compare them with the results of another
+# commit to find regressions:
+#
+#   benchmark.py --sizes 1000,10000 --output new.json --compare old.json
+#
+# Cases that fail (e.g. because pmbootstrap is missing) are recorded with
+# their error and don't stop the other cases, but the benchmark exits with an
+# error at the end.
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Same dir
+import common
+import synthetic_tree
+
+# pmbootstrap
+import add_pmbootstrap_to_import_path  # noqa
+import pmb.helpers.logging
+import pmb.helpers.other
+
+
+def get_all_apkbuilds(apkbuild_index):
+    """ Parse all APKBUILDs, failing if any of them can't be parsed (so the
+        case doesn't measure how fast errors get recorded). """
+    index = apkbuild_index.ApkbuildIndex(os.getcwd())
+    index.get_all()
+    if index.errors:
+        package_dir, error = next(iter(index.errors.items()))
+        raise RuntimeError(f"{len(index.errors)} APKBUILDs failed to parse,"
+                           f" e.g. {package_dir}: {error}")
+
+
+# Functions to measure: name => (module, function called with the module)
+functions = {
+    "common.get_apkbuild_paths": (
+        "common", lambda m: m.get_apkbuild_paths()),
+    "common.get_apkbuild_paths(upstream)": (
+        "common", lambda m: m.get_apkbuild_paths("upstream/master")),
+    "common.get_changed_files": (
+        "common", lambda m: m.get_changed_files()),
+    "common.get_changed_packages": (
+        "common", lambda m: m.get_changed_packages()),
+    "common.get_symlink_index": (
+        "common", lambda m: m.get_symlink_index()),
+    "tree_inventory.Inventory": (
+        "tree_inventory", lambda m: m.Inventory(os.getcwd())),
+    "codeowners.owners_many": (
+        "codeowners", lambda m: m.Codeowners().owners_many(
+            m.tree_inventory.Inventory(os.getcwd()).files)),
+    "apkbuild_index.get_all": (
+        "apkbuild_index", get_all_apkbuilds),
+    "revdep_index.ReverseDependencyIndex": (
+        "revdep_index", lambda m: m.ReverseDependencyIndex(m.parse_tree())),
+    "deviceinfo_table.DeviceinfoTable": (
+        "deviceinfo_table", lambda m: m.DeviceinfoTable(
+            os.getcwd(), [path.rsplit("/", 1)[0] for path
+                          in m.common.get_apkbuild_paths().values()
+                          if "/device-" in path])),
+}
+
+# Scripts to measure: name => arguments, relative to the tree
+scripts = {
+    "grep_rules.py": [".ci/lib/grep_rules.py"],
+    "codeowners.py": [".ci/lib/codeowners.py"],
+    "revdep_index.py": [".ci/lib/revdep_index.py"],
+    "deviceinfo_table.py": [".ci/lib/deviceinfo_table.py", "arch"],
+}
+
+# Only with --pytest, as it needs a configured pmbootstrap
+script_pytest = [sys.executable, "-m", "pytest", "-q", "-x",
+                 ".ci/testcases"]
+
+
+def init_pmbootstrap():
+    """ Prepare pmbootstrap's session cache and logging, which the APKBUILD
+        parser needs. The rest of what pmb.parse.arguments() does (like
+        reading the deviceinfo of the configured device) doesn't work in a
+        synthetic tree and isn't needed by the cases. """
+    if pmb.helpers.other.cache is None:
+        pmb.helpers.other.init_cache()
+    if not hasattr(logging, "verbose"):
+        pmb.helpers.logging.add_verbose_log_level()
+
+
+def run_function(name):
+    """ Run one function case in the current process (in the synthetic tree)
+        and print its duration as JSON in the last line. """
+    init_pmbootstrap()
+    module_name, func = functions[name]
+    module = importlib.import_module(module_name)
+    common.add_upstream_git_remote()
+    start = time.monotonic()
+    func(module)
+    print(json.dumps({"seconds": time.monotonic() - start}))
+
+
+def measure(path, command, internal):
+    """ :param path: synthetic tree
+        :param command: arguments of the process to run
+        :param internal: read the duration from the last line of the output,
+                         instead of measuring the whole process
+        :returns: (seconds, None) or (None, error string) """
+    start = time.monotonic()
+    result = subprocess.run(command, cwd=path, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            stdin=subprocess.DEVNULL)
+    seconds = time.monotonic() - start
+    output = result.stdout.decode(errors="replace").rstrip().splitlines()
+    if result.returncode:
+        return None, "\n".join(output[-10:])
+    if internal:
+        seconds = json.loads(output[-1])["seconds"]
+    return seconds, None
+
+
+def get_cases(with_pytest):
+    """ :returns: list of (name, command, internal) """
+    this = os.path.basename(__file__)
+    ret = [(name, [sys.executable, f".ci/lib/{this}", "--run-function", name],
+            True) for name in functions]
+    ret += [(name, [sys.executable] + command, False)
+            for name, command in scripts.items()]
+    if with_pytest:
+        ret.append(("pytest", script_pytest, False))
+    return ret
+
+
+def benchmark_tree(args, packages, workdir):
+    """ Generate one synthetic tree and run all cases in it.
+
+        :param packages: size of the tree
+        :returns: dict with the tree config and the results """
+    generator_args = synthetic_tree.get_parser().parse_args(
+        [f"--packages={packages}", f"--seed={args.seed}",
+         f"{workdir}/pmaports-{packages}"])
+    start = time.monotonic()
+    generator = synthetic_tree.generate(generator_args)
+    generate_seconds = time.monotonic() - start
+    print(f"{packages} packages: generated in {generate_seconds:.2f}s")
+
+    results = {}
+    for name, command, internal in get_cases(args.pytest):
+        runs = []
+        error = None
+        for _ in range(args.repeat):
+            seconds, error = measure(generator.path, command, internal)
+            if error:
+                break
+            runs.append(seconds)
+        if error:
+            results[name] = {"error": error}
+            print(f"  {name}: failed:")
+            print("    " + error.replace("\n", "\n    "))
+            continue
+        results[name] = {"seconds": runs, "median": statistics.median(runs)}
+        print(f"  {name}: {results[name]['median']:.3f}s")
+
+    return {"packages": packages,
+            "devices": generator.devices,
+            "generate_seconds": generate_seconds,
+            "results": results}
+
+
+def compare(current, previous, threshold):
+    """ Print the change of each case against previous results.
+
+        :param current: results of this run
+        :param previous: results loaded from the JSON file of another run
+        :param threshold: factor above which a case counts as regression
+        :returns: list of regressed "<packages>: <case>" """
+    ret = []
+    previous_trees = {tree["packages"]: tree for tree in previous["trees"]}
+    print("comparison:")
+    for tree in current["trees"]:
+        old_tree = previous_trees.get(tree["packages"])
+        if not old_tree:
+            continue
+        for name, result in tree["results"].items():
+            old = old_tree["results"].get(name, {})
+            if "median" not in result or not old.get("median"):
+                continue
+            factor = result["median"] / old["median"]
+            mark = ""
+            if factor > threshold:
+                mark = " REGRESSION"
+                ret.append(f"{tree['packages']}: {name}")
+            print(f"  {tree['packages']}: {name}: {old['median']:.3f}s ->"
+                  f" {result['median']:.3f}s ({factor:.2f}x){mark}")
+    return ret
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000",
+                        help="comma separated amounts of APKBUILDs of the"
+                        " synthetic trees (default: 1000)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per case, the median gets compared"
+                        " (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pytest", action="store_true",
+                        help="also run the testcases (needs pmbootstrap)")
+    parser.add_argument("--output", help="write the results to this JSON"
+                        " file")
+    parser.add_argument("--compare", help="JSON file of a previous run")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="slowdown factor that counts as regression"
+                        " (default: 1.25)")
+    parser.add_argument("--keep", action="store_true",
+                        help="don't delete the synthetic trees")
+    parser.add_argument("--run-function", help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    if args.run_function:
+        run_function(args.run_function)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="pmaports-benchmark-")
+    try:
+        ret = {"python": platform.python_version(),
+               "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "repeat": args.repeat,
+               "trees": [benchmark_tree(args, int(size), workdir)
+                         for size in args.sizes.split(",")]}
+    finally:
+        if args.keep:
+            print(f"synthetic trees: {workdir}")
+        else:
+            shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(ret, handle, indent=1)
+        print(f"results: {args.output}")
+
+    failed = [f"{tree['packages']}: {name}" for tree in ret["trees"]
+              for name, result in tree["results"].items()
+              if "error" in result]
+    regressions = []
+    if args.compare:
+        with open(args.compare) as handle:
+            regressions = compare(ret, json.load(handle), args.threshold)
+        if regressions:
+            print(f"ERROR: {len(regressions)} case(s) got slower than"
+                  f" {args.threshold}x: {', '.join(regressions)}")
+    if failed:
+        print(f"ERROR: {len(failed)} case(s) failed, the results are"
+              f" incomplete: {', '.join(failed)}")
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
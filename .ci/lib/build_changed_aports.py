@@ -1,23 +1,32 @@
 #!/usr/bin/env python3
 # Copyright 2021 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
+import os
 import sys
 
 # Same dir
+import arch_matrix
+import build_scheduler
+import build_times
 import common
-
-# pmbootstrap
-import add_pmbootstrap_to_import_path
-import pmb.parse
-import pmb.parse._apkbuild
-import pmb.helpers.pmaports
-
-
-def build_strict(packages, arch):
-    common.run_pmbootstrap(["build_init"])
-    common.run_pmbootstrap(["--details-to-stdout", "--no-ccache", "build",
-                            "--strict", "--force",
-                            "--arch", arch, ] + list(packages))
+import revdep_index
+
+
+def build_strict(packages, arch, times):
+    # Record the build durations from the pmbootstrap log, also when a build
+    # fails (without the failed one)
+    log = f"{build_scheduler.get_work_dirs(1)[0]}/log.txt"
+    offset = build_times.get_log_size(log)
+    complete = False
+    try:
+        common.run_pmbootstrap(["build_init"])
+        common.run_pmbootstrap(["--details-to-stdout", "--no-ccache", "build",
+                                "--strict", "--force",
+                                "--arch", arch, ] + list(packages))
+        complete = True
+    finally:
+        build_times.record_log(times, log, offset, complete)
+        times.save()
 
 
 def verify_checksums(packages, arch):
@@ -44,14 +53,23 @@ if __name__ == "__main__":
         sys.exit(1)
     arch = sys.argv[1]
 
-    # Get and print modified packages
+    # Packages to build for this arch from the arch matrix of the pipeline,
+    # if there is one (see arch_matrix.py). It already has the reverse
+    # dependencies of [ci:build-revdeps] and only the packages that can be
+    # built for the arch.
     common.add_upstream_git_remote()
-    packages = common.get_changed_packages()
-
-    # Package count sanity check
-    common.get_changed_packages_sanity_check(len(packages))
-
-    # [ci:skip-build]: verify checksums and stop
+    packages = None
+    matrix = os.environ.get("PMAPORTS_CI_ARCH_MATRIX")
+    if matrix and os.path.exists(matrix):
+        packages = arch_matrix.read(matrix, arch)
+        if packages is not None:
+            print(f"packages from {matrix}: {', '.join(packages)}")
+    from_matrix = packages is not None
+    if not from_matrix:
+        packages = common.get_changed_packages()
+
+    # [ci:skip-build]: verify checksums and stop (the sanity check below is
+    # skipped with this marker anyway)
     verify_only = common.commit_message_has_string("[ci:skip-build]")
     if verify_only:
         print("WARNING: not building changed packages ([ci:skip-build])!")
@@ -59,25 +77,40 @@ if __name__ == "__main__":
         verify_checksums(packages, arch)
         sys.exit(0)
 
-    # Prepare "args" to use pmbootstrap code
-    sys.argv = ["pmbootstrap", "chroot"]
-    args = pmb.parse.arguments()
-
-    # Filter out packages that can't be built for given arch
-    # (Iterate over copy of packages, because we modify it in this loop)
-    for package in packages.copy():
-        apkbuild_path = pmb.helpers.pmaports.find(args, package)
-        apkbuild = pmb.parse._apkbuild.apkbuild(f"{apkbuild_path}/APKBUILD")
-
-        if not pmb.helpers.pmaports.check_arches(apkbuild["arch"], arch):
-            print(f"{package}: not enabled for {arch}, skipping")
-            packages.remove(package)
+    apkbuilds = None
+    jobs = build_scheduler.get_jobs()
+    if not from_matrix:
+        # [ci:build-revdeps]: build packages depending on the changed ones
+        # too
+        packages = revdep_index.get_packages_to_build(packages)
+
+        # Filter out packages that can't be built for given arch
+        apkbuilds = arch_matrix.parse_apkbuilds(packages)
+        enabled = arch_matrix.filter_arch(apkbuilds, arch)
+        for package in packages.copy():
+            if package not in enabled:
+                print(f"{package}: not enabled for {arch}, skipping")
+                packages.remove(package)
+                del apkbuilds[package]
 
     # No packages: skip build
     if len(packages) == 0:
         print(f"no packages changed, which can be built for {arch}")
         sys.exit(0)
 
+    # The scheduler needs the dependencies between the packages
+    if apkbuilds is None and jobs > 1 and len(packages) > 1:
+        apkbuilds = arch_matrix.parse_apkbuilds(packages)
+
+    # Build time sanity check
+    common.get_changed_packages_sanity_check(packages, arch, apkbuilds)
+
     # Build packages
     print(f"building in strict mode for {arch}: {', '.join(packages)}")
-    build_strict(packages, arch)
+    times = build_times.BuildTimes()
+    if jobs == 1 or len(packages) == 1:
+        build_strict(packages, arch, times)
+    else:
+        # Independent packages in parallel, in separate work dirs
+        if not build_scheduler.build_parallel(apkbuilds, arch, jobs, times):
+            sys.exit(1)
@@ -3,6 +3,17 @@
 # Options: native slow
 # https://postmarketos.org/pmb-ci
 
+# Get the architecture from the symlink we are running
+arch="$(echo "$0" | cut -d '-' -f 2 | cut -d '.' -f 1)"
+
+# Exit early if the arch matrix of this pipeline (.ci/lib/arch_matrix.py) has
+# nothing to build for this arch, without installing pmbootstrap
+matrix="${PMAPORTS_CI_ARCH_MATRIX:-}"
+if [ -n "$matrix" ] && [ -e "$matrix" ] && grep -qx "$arch" "$matrix"; then
+	echo "no packages changed, which can be built for $arch"
+	exit 0
+fi
+
 if [ "$(id -u)" = 0 ]; then
 	set -x
 	wget "https://gitlab.com/postmarketOS/ci-common/-/raw/master/install_pmbootstrap.sh"
@@ -12,8 +23,11 @@ fi
 
 export PYTHONUNBUFFERED=1
 
-# Get the architecture from the symlink we are running
-arch="$(echo "$0" | cut -d '-' -f 2 | cut -d '.' -f 1)"
+# Set PMAPORTS_CI_BUILD_JOBS to build independent packages in parallel, each
+# group in its own pmbootstrap work dir (default: 1, one pmbootstrap build
+# call for all packages). Only the downloaded sources are shared, so every
+# extra job needs the disk space and the setup time (chroots, APKINDEX
+# downloads) of another build, see init_work_dir() in build_scheduler.py.
 
 set -x
 .ci/lib/build_changed_aports.py "$arch"
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Build changed packages in parallel. Packages that depend on each other
+# (directly or through other changed packages) end up in the same group and
+# get built in topological order in one pmbootstrap work dir. Independent
+# groups get built at the same time in separate work dirs.
+
+import concurrent.futures
+import os
+import shutil
+import subprocess
+import tempfile
+
+# Same dir
+import apkbuild_index
+import build_times
+import common
+
+
+def get_jobs():
+    """ :returns: maximum amount of parallel builds, from the
+                  PMAPORTS_CI_BUILD_JOBS environment variable (default: 1).
+                  Each slot after the first costs the disk space and setup
+                  time of another work dir, see init_work_dir(). """
+    return max(1, int(os.environ.get("PMAPORTS_CI_BUILD_JOBS") or 1))
+
+
+def get_dependency_graph(apkbuilds):
+    """ Find out which of the given packages depend on each other.
+
+        :param apkbuilds: dict of pkgname => parsed APKBUILD
+        :returns: dict of pkgname => set of pkgnames (from apkbuilds) that
+                  need to be built before it """
+    # Names that each package can be referenced by
+    providers = {}
+    for pkgname, apkbuild in apkbuilds.items():
+        names = [pkgname] + list(apkbuild["subpackages"].keys())
+        names += [apkbuild_index.get_depend_name(provide)
+                  for provide in apkbuild["provides"]]
+        for name in names:
+            providers[name] = pkgname
+
+    ret = {}
+    for pkgname, apkbuild in apkbuilds.items():
+        depends = apkbuild["depends"] + apkbuild["makedepends"]
+        for subpackage in apkbuild["subpackages"].values():
+            if subpackage:
+                depends += subpackage["depends"]
+
+        ret[pkgname] = set()
+        for depend in depends:
+            if depend.startswith("!"):
+                continue
+            provider = providers.get(apkbuild_index.get_depend_name(depend))
+            if provider and provider != pkgname:
+                ret[pkgname].add(provider)
+    return ret
+
+
+def topological_sort(graph):
+    """ :param graph: see get_dependency_graph()
+        :returns: list of pkgnames, each one after its dependencies. Packages
+                  in a dependency cycle get appended in alphabetical order,
+                  pmbootstrap reports the cycle when building them. """
+    ret = []
+    remaining = {pkgname: set(depends) for pkgname, depends in graph.items()}
+    while remaining:
+        ready = sorted(pkgname for pkgname, depends in remaining.items()
+                       if not depends)
+        if not ready:
+            ret += sorted(remaining)
+            break
+        for pkgname in ready:
+            del remaining[pkgname]
+        for depends in remaining.values():
+            depends.difference_update(ready)
+        ret += ready
+    return ret
+
+
+def get_groups(graph):
+    """ Split the packages into groups that don't depend on each other.
+
+        :param graph: see get_dependency_graph()
+        :returns: list of groups, each a topologically sorted list of
+                  pkgnames. Sorted by size, largest group first. """
+    # Undirected edges, so packages sharing a dependency end up together
+    neighbors = {pkgname: set(depends) for pkgname, depends in graph.items()}
+    for pkgname, depends in graph.items():
+        for depend in depends:
+            neighbors[depend].add(pkgname)
+
+    ret = []
+    seen = set()
+    for pkgname in sorted(graph):
+        if pkgname in seen:
+            continue
+        group = set()
+        todo = [pkgname]
+        while todo:
+            current = todo.pop()
+            if current in group:
+                continue
+            group.add(current)
+            todo += neighbors[current] - group
+        seen |= group
+        ret.append(topological_sort({p: graph[p] for p in group}))
+
+    return sorted(ret, key=lambda group: (-len(group), group))
+
+
+def assign_slots(groups, jobs, cost=len):
+    """ Distribute groups over build slots, so each slot has about the same
+        amount of work.
+
+        :param groups: see get_groups()
+        :param jobs: amount of slots
+        :param cost: function returning the estimated cost of a group
+        :returns: list of slots (without empty ones), each a list of pkgnames
+                  in build order """
+    slots = [[] for _ in range(jobs)]
+    costs = [0] * jobs
+    for group in sorted(groups, key=cost, reverse=True):
+        i = costs.index(min(costs))
+        slots[i] += group
+        costs[i] += cost(group)
+    return [slot for slot in slots if slot]
+
+
+def plan(apkbuilds, arch, jobs=None, times=None):
+    """ :param apkbuilds: dict of pkgname => parsed APKBUILD
+        :param jobs: maximum amount of parallel builds, default: get_jobs()
+        :param times: build_times.BuildTimes instance, used to balance the
+                      slots by estimated build time
+        :returns: list of slots as build_parallel() builds them, see
+                  assign_slots() """
+    times = times or build_times.BuildTimes()
+    graph = get_dependency_graph(apkbuilds)
+    return assign_slots(get_groups(graph), jobs or get_jobs(),
+                        lambda group: times.predict_total(group, arch))
+
+
+def predict_duration(apkbuilds, arch, jobs=None, times=None):
+    """ :param apkbuilds: see plan()
+        :returns: estimated seconds until all slots are done, i.e. the
+                  estimate of the slowest slot """
+    times = times or build_times.BuildTimes()
+    return max((times.predict_total(slot, arch)
+                for slot in plan(apkbuilds, arch, jobs, times)), default=0)
+
+
+def get_work_dirs(count):
+    """ :param count: amount of slots
+        :returns: pmbootstrap work dirs for the slots. The first one is the
+                  configured work dir, the others are next to it. """
+    work = common.run_pmbootstrap(["config", "work"], True).strip()
+    return [work] + [f"{work}_build_{slot}" for slot in range(1, count)]
+
+
+def init_work_dir(work, template):
+    """ Create the work dir of a build slot, like 'pmbootstrap init' does.
+        Without it, pmbootstrap stops with "Work path not found", and without
+        the version file it asks whether to migrate the work dir.
+
+        The downloaded sources (cache_distfiles) are shared with the
+        configured work dir. Everything else exists once per slot: the
+        chroots of build_init and for cross compiling, the built packages
+        and the apk cache with the APKINDEX files (not shared, as all slots
+        update them at the same time). So each slot needs about as much disk
+        space and setup time as a build with one job.
+
+        :param work: work dir of the slot
+        :param template: configured work dir, already initialized """
+    version = f"{template}/version"
+    if not os.path.exists(version):
+        raise RuntimeError(f"{version} not found, run 'pmbootstrap init'"
+                           " first")
+    os.makedirs(f"{work}/cache_git", 0o700, exist_ok=True)
+    shutil.copy(version, f"{work}/version")
+
+    # pmbootstrap bind mounts it into the chroots, which follows the symlink
+    distfiles = f"{template}/cache_distfiles"
+    os.makedirs(distfiles, exist_ok=True)
+    if not os.path.lexists(f"{work}/cache_distfiles"):
+        os.symlink(distfiles, f"{work}/cache_distfiles")
+
+
+def build_slot(slot, packages, arch, work, log):
+    """ Build packages in one work dir and write the output to a log file.
+
+        :returns: (slot, packages, returncode, log, offset), where offset is
+                  the size of the pmbootstrap log.txt before building """
+    offset = build_times.get_log_size(f"{work}/log.txt")
+    pmbootstrap = ["pmbootstrap", "--aports", common.get_pmaports_dir(),
+                   "-w", work]
+    with open(log, "w") as handle:
+        for cmd in [["build_init"],
+                    ["--details-to-stdout", "--no-ccache", "build", "--strict",
+                     "--force", "--arch", arch] + packages]:
+            returncode = subprocess.run(pmbootstrap + cmd, stdout=handle,
+                                        stderr=subprocess.STDOUT,
+                                        check=False).returncode
+            if returncode:
+                break
+    return slot, packages, returncode, log, offset
+
+
+def build_parallel(apkbuilds, arch, jobs=None, times=None):
+    """ Build packages in parallel, in up to jobs work dirs at once.
+
+        :param apkbuilds: dict of pkgname => parsed APKBUILD
+        :param arch: architecture to build for
+        :param jobs: maximum amount of parallel builds, default: get_jobs()
+        :param times: build_times.BuildTimes instance, used to balance the
+                      slots by estimated build time. The durations of the
+                      builds get recorded in it.
+        :returns: True if all packages were built successfully """
+    times = times or build_times.BuildTimes()
+    slots = plan(apkbuilds, arch, jobs, times)
+    for slot, packages in enumerate(slots):
+        print(f"slot {slot}: {', '.join(packages)}")
+
+    failed = False
+    work_dirs = get_work_dirs(len(slots))
+    for work in work_dirs[1:]:
+        init_work_dir(work, work_dirs[0])
+    logs_dir = tempfile.mkdtemp(prefix="pmaports_ci_build_")
+    with concurrent.futures.ThreadPoolExecutor(len(slots)) as executor:
+        futures = [executor.submit(build_slot, slot, packages, arch,
+                                   work_dirs[slot],
+                                   f"{logs_dir}/slot_{slot}.log")
+                   for slot, packages in enumerate(slots)]
+        for future in concurrent.futures.as_completed(futures):
+            slot, packages, returncode, log, offset = future.result()
+            status = "FAILED" if returncode else "done"
+            print(f"--- slot {slot} {status}: {', '.join(packages)} ---")
+            with open(log) as handle:
+                print(handle.read(), end="", flush=True)
+            failed = failed or returncode != 0
+            build_times.record_log(times, f"{work_dirs[slot]}/log.txt",
+                                   offset, returncode == 0)
+
+    times.save()
+    return not failed
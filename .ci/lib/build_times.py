@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Estimate how long it takes to build packages in CI. Durations of previous
+# builds get parsed from the pmbootstrap log and stored in a JSON file per
+# pkgname and arch. Packages that were never built in CI get a default
+# estimate based on their name (kernels take much longer than firmware).
+#
+# The JSON file is set with PMAPORTS_CI_BUILD_TIMES, without it only the
+# default estimates are used. In gitlab CI, the file is kept in the cache of
+# the build-{arch} jobs.
+#
+# build_times.py PKGNAME [PKGNAME...]
+#   Print the estimated build time of packages for each arch.
+
+import json
+import os
+import re
+import statistics
+import sys
+
+# Keep the last builds of each package, so the estimate follows changes
+history = 5
+
+# Default estimates in seconds, for packages without recorded builds
+default_seconds = {
+    "linux-": 30 * 60,
+    "firmware-": 2 * 60,
+    "device-": 1 * 60,
+    "postmarketos-ui-": 1 * 60,
+}
+default_seconds_other = 5 * 60
+
+# "[12:34:56] (native) build x86_64/hello-world-1-r2.apk"
+log_build_re = re.compile(r"^\[(\d\d):(\d\d):(\d\d)\] \([^)]*\) build"
+                          r" ([^/ ]+)/(\S+)-[^-]+-r\d+\.apk")
+log_time_re = re.compile(r"^\[(\d\d):(\d\d):(\d\d)\] ")
+
+
+def get_budget():
+    """ :returns: time budget in seconds for building the changed packages
+                  of one arch, from the PMAPORTS_CI_BUILD_BUDGET environment
+                  variable in minutes (default: 180) """
+    return int(os.environ.get("PMAPORTS_CI_BUILD_BUDGET") or 180) * 60
+
+
+def get_default(pkgname):
+    """ :returns: estimated build time in seconds for a package that was
+                  never built in CI """
+    for prefix, seconds in default_seconds.items():
+        if pkgname.startswith(prefix):
+            return seconds
+    return default_seconds_other
+
+
+def format_duration(seconds):
+    """ :returns: e.g. "1h 05min" or "3min" """
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"{minutes}min"
+    return f"{minutes // 60}h {minutes % 60:02}min"
+
+
+class BuildTimes:
+    """ Recorded build durations, stored as
+        {"<arch>": {"<pkgname>": [seconds, …]}} """
+
+    def __init__(self, path=None):
+        """ :param path: to the JSON file, default: PMAPORTS_CI_BUILD_TIMES.
+                         A missing file is treated like an empty one. """
+        self.path = path or os.environ.get("PMAPORTS_CI_BUILD_TIMES")
+        self.durations = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as handle:
+                self.durations = json.load(handle)
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        with open(f"{self.path}.new", "w") as handle:
+            json.dump(self.durations, handle, indent=1, sort_keys=True)
+        os.replace(f"{self.path}.new", self.path)
+
+    def record(self, arch, pkgname, seconds):
+        durations = self.durations.setdefault(arch, {}).setdefault(pkgname,
+                                                                    [])
+        durations.append(round(seconds))
+        del durations[:-history]
+
+    def predict(self, pkgname, arch=None):
+        """ :param arch: architecture of the build, None to estimate the
+                         slowest arch
+            :returns: estimated build time in seconds """
+        if arch and pkgname in self.durations.get(arch, {}):
+            return statistics.median(self.durations[arch][pkgname])
+
+        # Use the builds of other arches, in case the package was never built
+        # for this one (good enough, most packages build natively)
+        recorded = [statistics.median(durations[pkgname])
+                    for durations in self.durations.values()
+                    if pkgname in durations]
+        if recorded:
+            return max(recorded)
+        return get_default(pkgname)
+
+    def predict_total(self, pkgnames, arch=None):
+        """ :returns: estimated time in seconds to build all pkgnames one
+                      after another """
+        return sum(self.predict(pkgname, arch) for pkgname in pkgnames)
+
+
+def parse_log(lines, complete=True):
+    """ Get the durations of builds from a pmbootstrap log. A build ends when
+        the next one starts, or with the last line of the log.
+
+        :param lines: lines of the log, e.g. an open file
+        :param complete: set to False if the last build did not finish (e.g.
+                         because it failed), so it doesn't get recorded
+        :returns: list of (arch, pkgname, seconds) """
+    ret = []
+    current = None  # (arch, pkgname, start seconds)
+    last = None
+    for line in lines:
+        match = log_time_re.match(line)
+        if not match:
+            continue
+        hours, minutes, seconds = map(int, match.groups())
+        now = hours * 3600 + minutes * 60 + seconds
+        # The log only has the time of day
+        while last is not None and now < last:
+            now += 24 * 3600
+        last = now
+
+        build = log_build_re.match(line)
+        if not build:
+            continue
+        if current:
+            ret.append((current[0], current[1], now - current[2]))
+        current = (build.group(4), build.group(5), now)
+
+    if current and complete:
+        ret.append((current[0], current[1], last - current[2]))
+    return ret
+
+
+def get_log_size(path):
+    """ :returns: size of the log, to pass as offset to record_log() before
+                  running pmbootstrap """
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def record_log(times, path, offset=0, complete=True):
+    """ Record the build durations of a pmbootstrap log.
+
+        :param times: BuildTimes instance
+        :param path: to the pmbootstrap log.txt
+        :param offset: only parse the log after this position, i.e. the size
+                       of the log before the builds started
+        :param complete: see parse_log() """
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        handle.seek(offset)
+        for arch, pkgname, seconds in parse_log(handle, complete):
+            times.record(arch, pkgname, seconds)
+
+
+if __name__ == "__main__":
+    times = BuildTimes()
+    pkgnames = sys.argv[1:]
+    if not pkgnames:
+        print(f"usage: {sys.argv[0]} PKGNAME [PKGNAME...]")
+        sys.exit(1)
+    arches = sorted(times.durations) or [None]
+    for arch in arches:
+        total = times.predict_total(pkgnames, arch)
+        print(f"{arch or 'default'}: {format_duration(total)}")
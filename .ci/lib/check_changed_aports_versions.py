@@ -2,12 +2,10 @@
 # Copyright 2021 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import glob
-import tempfile
 import sys
-import subprocess
 
 # Same dir
+import apkbuild_index
 import common
 
 # pmbootstrap
@@ -16,30 +14,41 @@ import pmb.parse
 import pmb.parse.version
 import pmb.helpers.logging
 
+# Parsed APKBUILDs by (package, revision), device packages get looked at
+# more than once. Missing APKBUILDs are not cached, so a lookup with
+# check=True after one with check=False still raises.
+contents_cache = {}
+
+
 def get_package_contents(args, package, revision, check=True):
-    # Redirect stderr to /dev/null, so git doesn't complain about files not
-    # existing in upstream branch for new packages
-    stderr = None
-    if not check:
-        stderr = subprocess.DEVNULL
-
-    # Run something like "git show upstream/master:main/hello-world/APKBUILD"
-    pmaports_dir = common.get_pmaports_dir()
-    pattern = pmaports_dir + "/**/" + package + "/APKBUILD"
-    path = glob.glob(pattern, recursive=True)[0][len(pmaports_dir + "/"):]
-    apkbuild_content = common.run_git(["show", revision + ":" + path], check,
-                                      stderr)
+    """ :param check: raise an error if the APKBUILD doesn't exist in the
+                      revision, instead of returning None (e.g. for new
+                      packages in the upstream branch) """
+    if (package, revision) not in contents_cache:
+        parsed = parse_package_contents(args, package, revision, check)
+        if parsed is None:
+            return None
+        contents_cache[(package, revision)] = parsed
+    return contents_cache[(package, revision)]
+
+
+def parse_package_contents(args, package, revision, check):
+    # Read something like "upstream/master:main/hello-world/APKBUILD" through
+    # the shared "git cat-file --batch" process. Look up the path in the
+    # given revision, as the package may be in another dir there.
+    path = common.get_apkbuild_paths(revision).get(package)
+    if not path:
+        if check:
+            raise RuntimeError(f"{package}: APKBUILD not found in {revision}")
+        return None
+    apkbuild_content = common.get_git_object_reader().read(revision, path)
     if not apkbuild_content:
+        if check and apkbuild_content is None:
+            raise RuntimeError(f"{path} not found in {revision}")
         return None
 
-    # Save APKBUILD to a temporary path and parse it from there. (Not the best
-    # way to do things, but good enough for this CI script.)
-    with tempfile.TemporaryDirectory() as tempdir:
-        with open(tempdir + "/APKBUILD", "w", encoding="utf-8") as handle:
-            handle.write(apkbuild_content)
-        parsed = pmb.parse.apkbuild(tempdir + "/APKBUILD", False, False)
-
-    return parsed
+    return apkbuild_index.parse_text(apkbuild_content, f"{revision}:{path}",
+                                     False, False)
 
 
 def get_package_version(args, package, revision, check=True):
@@ -102,8 +111,8 @@ def check_versions(args, packages):
     # want to check if the version was increased towards *current* upstream
     # branch HEAD.
     commit = f"upstream/{common.get_upstream_branch()}"
-    if common.run_git(["rev-parse", "HEAD"]) == common.run_git(["rev-parse",
-                                                                commit]):
+    reader = common.get_git_object_reader()
+    if reader.rev_parse("HEAD") == reader.rev_parse(commit):
         print(f"NOTE: {commit} is on same commit as HEAD, comparing"
               " HEAD against HEAD~1.")
         commit = "HEAD~1"
@@ -176,8 +185,8 @@ if __name__ == "__main__":
     packages = common.get_changed_packages()
     print(f"Changed packages: {packages}")
 
-    # Verify modified package count
-    common.get_changed_packages_sanity_check(len(packages))
+    # Verify estimated build time of the modified packages
+    common.get_changed_packages_sanity_check(packages)
     if len(packages) == 0:
         print("no aports changed in this branch")
         exit(0)
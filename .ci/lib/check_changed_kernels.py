@@ -2,6 +2,7 @@
 # Copyright 2024 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import concurrent.futures
 import glob
 import tempfile
 import sys
@@ -9,29 +10,104 @@ import subprocess
 
 # Same dir
 import common
+import kconfigcheck
+import parallel
+
+
+def run_kconfig_check(pkgname, capture):
+    """ :param capture: return the output instead of printing it directly
+        :returns: (pkgname, returncode, output) """
+    cmd = ["pmbootstrap", "kconfig", "check", "--keep-going", pkgname]
+    if not capture:
+        return pkgname, subprocess.run(cmd, check=False).returncode, None
+
+    p = subprocess.run(cmd, check=False, stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT, universal_newlines=True)
+    return pkgname, p.returncode, p.stdout
+
+
+def check_kconfig(pkgnames, jobs=None):
+    """ Run "pmbootstrap kconfig check" for each kernel. With more than one
+        job, the kernels get checked in parallel and the output of each check
+        gets printed as soon as it is done.
+
+        :param pkgnames: kernel package names, e.g. ["linux-postmarketos"]
+        :param jobs: see parallel.get_jobs()
+        :returns: sorted list of pkgnames that failed the check """
+    jobs = min(parallel.get_jobs(jobs), max(1, len(pkgnames)))
+    failed = []
+
+    if jobs == 1:
+        for i in range(len(pkgnames)):
+            pkgname = pkgnames[i]
+            print(f"  ({i+1}/{len(pkgnames)}) {pkgname}")
+            if run_kconfig_check(pkgname, False)[1]:
+                failed.append(pkgname)
+        return sorted(failed)
+
+    print(f"Checking {len(pkgnames)} kernels with {jobs} jobs")
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        futures = [executor.submit(run_kconfig_check, pkgname, True)
+                   for pkgname in pkgnames]
+        done = 0
+        for future in concurrent.futures.as_completed(futures):
+            pkgname, returncode, output = future.result()
+            done += 1
+            status = "FAILED" if returncode else "OK"
+            print(f"  ({done}/{len(pkgnames)}) {pkgname}: {status}")
+            if returncode:
+                print(output, end="", flush=True)
+                failed.append(pkgname)
+
+    return sorted(failed)
+
+
+def compare_kconfigcheck(pkgnames, failed):
+    """ Compare the result of "pmbootstrap kconfig check" with the offline
+        implementation in kconfigcheck.py, which is not used for the result
+        until it is known to match. Differences only get printed.
+
+        :param pkgnames: kernels that were checked
+        :param failed: kernels that failed "pmbootstrap kconfig check" """
+    try:
+        failed_offline = kconfigcheck.check_kernels(pkgnames)
+    except (RuntimeError, ValueError) as e:
+        print(f"WARNING: kconfigcheck.py failed: {e}")
+        return
+
+    different = sorted(set(failed) ^ set(failed_offline))
+    if not different:
+        print("kconfigcheck.py: same result as pmbootstrap")
+        return
+
+    print("WARNING: kconfigcheck.py and pmbootstrap disagree on:")
+    for pkgname in different:
+        if pkgname in failed:
+            print(f"  {pkgname}: fails with pmbootstrap only")
+            continue
+        print(f"  {pkgname}: fails with kconfigcheck.py only:")
+        for error in failed_offline[pkgname]:
+            print(f"    {error}")
+
+
+def get_all_kernels():
+    """ :returns: sorted list of all kernel packages in pmaports, like
+                  "pmbootstrap kconfig check" without a package name checks
+                  them (kernels with !pmb:kconfigcheck in options get skipped
+                  by pmbootstrap) """
+    return sorted(pkgname for pkgname in common.get_apkbuild_paths()
+                  if pkgname.startswith("linux-"))
+
+
+def show_failed(failed):
+    print("")
+    print(f"{len(failed)} kernel config(s) failed the check:")
+    for pkgname in failed:
+        print(f"  {pkgname}")
 
 
-def check_kconfig(pkgnames):
-    last_failed = None
-    for i in range(len(pkgnames)):
-        pkgname = pkgnames[i]
-        print(f"  ({i+1}/{len(pkgnames)}) {pkgname}")
-
-        p = subprocess.run(["pmbootstrap", "kconfig", "check", "--keep-going", pkgname],
-                           check=False)
-
-        if p.returncode:
-            last_failed = pkgname
-
-    return last_failed
-
-
-def check_kconfig_all():
-    p = subprocess.run(["pmbootstrap", "kconfig", "check", "--keep-going"], check=False)
-    return p.returncode == 0
-
-
-def show_error(last_failed):
+def show_error(failed):
+    show_failed(failed)
     print("")
     print("---")
     print("")
@@ -39,10 +115,12 @@ def show_error(last_failed):
           " patch merged.")
     print("")
     print("Edit your kernel config:")
-    print(f"  pmbootstrap kconfig edit {last_failed}")
+    for pkgname in failed:
+        print(f"  pmbootstrap kconfig edit {pkgname}")
     print("")
     print("Test this kernel config again:")
-    print(f"  pmbootstrap kconfig check {last_failed}")
+    for pkgname in failed:
+        print(f"  pmbootstrap kconfig check {pkgname}")
     print("")
     print("Run this check again (on all kernels you modified):")
     print("  pmbootstrap ci kconfig")
@@ -51,7 +129,8 @@ def show_error(last_failed):
     print("")
 
 
-def show_error_all():
+def show_error_all(failed):
+    show_failed(failed)
     print("")
     print("---")
     print("")
@@ -79,8 +158,11 @@ if __name__ == "__main__":
 
     if "kconfigcheck.toml" in common.get_changed_files():
         print("kconfigcheck.toml changed -> checking all kernels")
-        if not check_kconfig_all():
-            show_error_all()
+        pkgnames = get_all_kernels()
+        failed = check_kconfig(pkgnames)
+        compare_kconfigcheck(pkgnames, failed)
+        if failed:
+            show_error_all(failed)
             exit(1)
         exit(0)
 
@@ -91,8 +173,8 @@ if __name__ == "__main__":
         print("No kernels changed in this branch")
         exit(0)
 
-    last_failed = check_kconfig(pkgnames)
+    failed = check_kconfig(pkgnames)
 
-    if last_failed:
-        show_error(last_failed)
+    if failed:
+        show_error(failed)
         exit(1)
@@ -4,10 +4,22 @@
 
 import argparse
 import glob
+import html
+import json
 import os
+import re
 import sys
+import time
+import urllib.error
+import urllib.parse
 import urllib.request
 
+wiki_url = "http://wiki.postmarketos.org/wiki"
+
+# Characters that device codenames consist of, e.g. "xiaomi-jasmine_sprout"
+# or "surftab-wintron7.0". Everything else separates words in the pages.
+codename_re = re.compile(r"[A-Za-z0-9_.-]+")
+
 
 def get_devices():
     """:returns: list of all devices"""
@@ -28,53 +40,127 @@ def get_devices():
     return sorted(ret)
 
 
-def get_wiki_devices_html(path):
-    """:param path: to a local file with the saved content of the devices wiki
-                    page or None to download a fresh copy
-       :returns: HTML of the page, split into booting and not booting:
-                 {"booting": "<!DOCTYPE HTML>\n<html..."
-                  "not_booting": "Not booting</span></h2>\n<p>These..."}"""
-    content = ""
+def parse_codenames(content):
+    """:param content: HTML of a wiki page or a part of it
+       :returns: set of all words that could be device codenames, from the
+                 text as well as from links (e.g. "Device_(codename)")"""
+    content = html.unescape(urllib.parse.unquote(content))
+    ret = set()
+    for word in codename_re.findall(content):
+        # Dots at the start or end of a word are punctuation
+        ret.add(word.strip("."))
+    return ret
+
+
+def read_snapshot(cache_dir, page):
+    """:param cache_dir: directory with the snapshots of wiki pages
+       :param page: name of the wiki page, e.g. "Devices"
+       :returns: (content, metadata) or (None, None) if there is no snapshot.
+                 metadata is a dict with "etag", "last_modified" and
+                 "fetched" (unix time of the last download or validation)"""
+    path = f"{cache_dir}/{page}"
+    if not os.path.exists(f"{path}.html") or not os.path.exists(f"{path}.json"):
+        return None, None
+    with open(f"{path}.html", encoding="utf-8") as handle:
+        content = handle.read()
+    with open(f"{path}.json") as handle:
+        return content, json.load(handle)
+
+
+def write_snapshot(cache_dir, page, content, metadata):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = f"{cache_dir}/{page}"
+    with open(f"{path}.html", "w", encoding="utf-8") as handle:
+        handle.write(content)
+    with open(f"{path}.json", "w") as handle:
+        json.dump(metadata, handle, indent=1)
+
+
+def get_wiki_page(page, path=None, cache_dir=None, max_age=0, offline=False):
+    """:param page: name of the wiki page, e.g. "Devices"
+       :param path: to a local file with the saved content of the page, or
+                    None to use the snapshot or download the page
+       :param cache_dir: directory for snapshots of the downloaded pages, or
+                         None to always download the page
+       :param max_age: use a snapshot without asking the wiki if it is newer
+                       than this amount of seconds. Older snapshots only get
+                       downloaded again if the page has changed (ETag and
+                       Last-Modified headers).
+       :param offline: don't access the network, only use path or the
+                       snapshot (no matter how old it is)
+       :returns: HTML of the page"""
     if path:
-        # Read file
         with open(path, encoding="utf-8") as handle:
-            content = handle.read()
-    else:
-        # Download wiki page
-        url = "http://wiki.postmarketos.org/wiki/Devices"
-        content = urllib.request.urlopen(url).read().decode("utf-8")
-
+            return handle.read()
+
+    content, metadata = (None, None)
+    if cache_dir:
+        content, metadata = read_snapshot(cache_dir, page)
+
+    if offline:
+        if content is None:
+            print(f"*** {page}: no local file or snapshot of the wiki page"
+                  " (offline mode)")
+            sys.exit(2)
+        return content
+    if content is not None and time.time() - metadata["fetched"] < max_age:
+        return content
+
+    # Download wiki page, unless it didn't change since the snapshot
+    request = urllib.request.Request(f"{wiki_url}/{page}")
+    if content is not None:
+        if metadata.get("etag"):
+            request.add_header("If-None-Match", metadata["etag"])
+        if metadata.get("last_modified"):
+            request.add_header("If-Modified-Since", metadata["last_modified"])
+    try:
+        with urllib.request.urlopen(request) as response:
+            content = response.read().decode("utf-8")
+            metadata = {"etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified")}
+    except urllib.error.HTTPError as e:
+        if e.code != 304 or content is None:
+            raise
+        print(f"{page}: not modified since the snapshot")
+
+    if cache_dir:
+        metadata["fetched"] = time.time()
+        write_snapshot(cache_dir, page, content, metadata)
+    return content
+
+
+def get_wiki_devices(content):
+    """:param content: HTML of the devices wiki page
+       :returns: device codenames of the page, split into booting and not
+                 booting: {"booting": {"pine64-pinephone", …},
+                           "not_booting": {…}}"""
     # Split into booting and not booting
     split = content.split("<span class=\"mw-headline\" id=\"Non-booting_devices\">")
 
     if len(split) != 2:
         print("*** Failed to parse wiki page")
         sys.exit(2)
-    return {"booting": split[0], "not_booting": split[1]}
+    return {"booting": parse_codenames(split[0]),
+            "not_booting": parse_codenames(split[1])}
 
 
-def get_wiki_renamed_devices_html():
-    """:returns: HTML of the page"""
-    # Download wiki page
-    url = "http://wiki.postmarketos.org/wiki/Renamed_Devices"
-    return urllib.request.urlopen(url).read().decode("utf-8")
-
-
-def check_device(device, html, is_booting):
-    """:param is_booting: require the device to be in the booting section, not
+def check_device(device, wiki, is_booting):
+    """:param wiki: codenames from the wiki, see get_wiki_devices(), with an
+                    additional "renamed" set from the Renamed_Devices page
+       :param is_booting: require the device to be in the booting section, not
                           just anywhere in the page (i.e. in the not booting
                           table).
        :returns: True when the device is in the appropriate section."""
-    if device in html["booting"]:
+    if device in wiki["booting"]:
         return True
-    if device in html["not_booting"]:
+    if device in wiki["not_booting"]:
         if is_booting:
             print(device + ": still in 'not booting' section (if this is a"
                   " merge request, your device should be in the booting"
                   " section already)")
             return False
         return True
-    if device in html["renamed"]:
+    if device in wiki["renamed"]:
         print(f"WARNING: {device} was renamed in the wiki")
         return True
 
@@ -93,14 +179,33 @@ def main():
     parser.add_argument("--path", help="instead of downloading the devices"
                         " page from the wiki, use a local HTML file",
                         default=None)
+    parser.add_argument("--renamed-path", help="instead of downloading the"
+                        " renamed devices page from the wiki, use a local"
+                        " HTML file", default=None)
+    parser.add_argument("--cache-dir", help="keep snapshots of the downloaded"
+                        " wiki pages in this directory, and only download"
+                        " them again if they changed",
+                        default=os.environ.get("PMAPORTS_CI_WIKI_CACHE"))
+    parser.add_argument("--max-age", help="use snapshots younger than this"
+                        " amount of seconds without asking the wiki if the"
+                        " page changed (default: 0)", type=int, default=0)
+    parser.add_argument("--offline", help="don't access the network, only"
+                        " use the local HTML files and snapshots",
+                        action="store_true")
     args = parser.parse_args()
 
     # Check all devices
-    html = get_wiki_devices_html(args.path)
-    html["renamed"] = get_wiki_renamed_devices_html()
+    wiki = get_wiki_devices(get_wiki_page("Devices", args.path,
+                                          args.cache_dir, args.max_age,
+                                          args.offline))
+    wiki["renamed"] = parse_codenames(get_wiki_page("Renamed_Devices",
+                                                    args.renamed_path,
+                                                    args.cache_dir,
+                                                    args.max_age,
+                                                    args.offline))
     error = False
     for device in get_devices():
-        if not check_device(device, html, args.booting):
+        if not check_device(device, wiki, args.booting):
             error = True
 
     # Ask to adjust the wiki
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Parse the sha512sums block at the end of APKBUILDs and verify checksums of
+# local sources. Used by the testsuite and by .githooks/pre-commit:
+#
+# checksums.py APKBUILD [SOURCE...]
+#   Verify that the local sources of a staged APKBUILD are listed in its
+#   sha512sums, staged or committed, and that the checksums match the staged
+#   files. The SOURCE arguments are the local sources from $source.
+
+import concurrent.futures
+import hashlib
+import os
+import sys
+
+# Same dir
+import common
+
+start = 'sha512sums="'
+
+
+def read_checksums_block(apkbuild_path, chunk_size=8192):
+    """
+    Read the APKBUILD backwards from the end, until reaching the line that
+    starts with 'sha512sums="'. That block is at the bottom of the file, so
+    this is usually only one read.
+
+    :param apkbuild_path: full path to the APKBUILD
+    :param chunk_size: bytes to read at once
+    :returns: list of lines from the (last) sha512sums line to the end of the
+              file, or an empty list if there is none
+    """
+    marker = start.encode()
+    with open(apkbuild_path, "rb") as handle:
+        pos = handle.seek(0, os.SEEK_END)
+        data = b""
+        while True:
+            found = data.rfind(b"\n" + marker)
+            if found != -1:
+                data = data[found + 1:]
+                break
+            if pos == 0:
+                if not data.startswith(marker):
+                    return []
+                break
+            read = min(chunk_size, pos)
+            pos -= read
+            handle.seek(pos)
+            data = handle.read(read) + data
+
+    return data.decode("utf-8").split("\n")
+
+
+def parse_source_from_checksums(apkbuild_path):
+    """
+    Read the APKBUILD file and parse source files from the checksums at the
+    bottom. This has always the same format, even if $source is built with hard
+    to parse shell code (like in postmarketos-base).
+
+    :param apkbuild_path: full path to the APKBUILD
+    :returns: dict of parsed "source" filenames and checksums, e.g.:
+              {"first.patch": "b4dc4f3…",
+               "second.patch": "b4dc4f3…"}
+    """
+    ret = {}
+
+    for line in read_checksums_block(apkbuild_path):
+        # sha512sums may have lines without checksums:
+        # https://gitlab.alpinelinux.org/alpine/abuild/-/merge_requests/73
+        if "  " not in line:
+            continue
+
+        try:
+            checksum, filename = line.rstrip().split("  ", 2)
+        except ValueError:
+            raise ValueError("Failed to parse checksums. Try to delete the"
+                             " checksums and generate them again with"
+                             f" 'pmbootstrap checksum': {apkbuild_path}")
+
+        # Cut off 'sha512sums="' if the first checksum is in that line
+        if checksum.startswith(start):
+            checksum = checksum[len(start):]
+
+        # Find end
+        if filename.endswith('"'):
+            filename = filename[:-1]
+
+        ret[filename] = checksum
+    return ret
+
+
+def sha512(source):
+    """ :param source: full path to a file, or the contents as bytes
+        :returns: sha512 checksum as hex string """
+    if isinstance(source, bytes):
+        return hashlib.sha512(source).hexdigest()
+
+    ret = hashlib.sha512()
+    with open(source, "rb") as handle:
+        while chunk := handle.read(1024 * 1024):
+            ret.update(chunk)
+    return ret.hexdigest()
+
+
+def sha512_many(sources, jobs=None):
+    """ Calculate checksums in a thread pool (hashlib releases the GIL while
+        hashing, so this runs in parallel).
+
+        :param sources: list of file paths or bytes, see sha512()
+        :param jobs: maximum amount of threads, None for one per CPU core
+        :returns: list of checksums, in the same order as sources """
+    sources = list(sources)
+    if len(sources) < 2:
+        return [sha512(source) for source in sources]
+
+    jobs = min(jobs or os.cpu_count() or 1, len(sources))
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        return list(executor.map(sha512, sources))
+
+
+def verify_local_sources(local_sources, jobs=None):
+    """ Compare checksums of local sources with the sha512sums blocks, hashing
+        all of them in one thread pool.
+
+        :param local_sources: list of (package_dir, filename, source,
+                              checksum), where package_dir is the relative
+                              package dir, source is the file path or
+                              contents (see sha512()) and checksum is the
+                              expected checksum from the APKBUILD
+        :param jobs: see sha512_many()
+        :returns: list of error strings """
+    actual = sha512_many([source for _, _, source, _ in local_sources], jobs)
+
+    ret = []
+    for (package_dir, filename, _, checksum), result in zip(local_sources,
+                                                            actual):
+        if result != checksum:
+            pkgname = os.path.basename(package_dir)
+            ret.append(f"{package_dir}: bad checksum for file \"{filename}\""
+                       f" (hint: run pmbootstrap checksum {pkgname})")
+    return ret
+
+
+def verify_staged(apkbuild, sources):
+    """ Verify local sources of a staged APKBUILD for the pre-commit hook.
+
+        :param apkbuild: path to the APKBUILD relative to the pmaports dir
+        :param sources: names of the local sources from $source
+        :returns: list of error strings """
+    package_dir = os.path.dirname(apkbuild)
+    checksums = parse_source_from_checksums(
+        os.path.join(common.get_pmaports_dir(), apkbuild))
+
+    # Staged files of the package: "<mode> <object> <stage>\t<file>"
+    staged = {}
+    for entry in common.run_git(["ls-files", "-s", "-z", "--",
+                                 package_dir]).split("\0"):
+        if entry:
+            info, path = entry.split("\t", 1)
+            mode, blob, _ = info.split(" ")
+            staged[path] = (mode, blob)
+
+    ret = []
+    local_sources = []
+    reader = common.get_git_object_reader()
+    for filename in sources:
+        if filename not in checksums:
+            ret.append(f"{package_dir}: file \"{filename}\" is missing in"
+                       " $sha512sums (hint: run pmbootstrap checksum)")
+            continue
+
+        path = f"{package_dir}/{filename}"
+        if path not in staged:
+            ret.append(f"{package_dir}: missing file \"{filename}\"")
+            continue
+
+        mode, blob = staged[path]
+        if mode == "120000":
+            continue  # symlink
+        local_sources.append((package_dir, filename, reader.read(blob),
+                              checksums[filename]))
+
+    return ret + verify_local_sources(local_sources)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} APKBUILD [SOURCE...]")
+        sys.exit(1)
+
+    errors = verify_staged(sys.argv[1], sys.argv[2:])
+    for error in errors:
+        print(f"\033[0;31mpre-commit:\033[0m {error}", file=sys.stderr)
+    if errors:
+        sys.exit(1)
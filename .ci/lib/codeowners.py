@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Parse CODEOWNERS and compile all patterns into one trie of path segments,
+# so looking up the owners of a path only depends on the depth of the path
+# and not on the amount of patterns. Literal segments, "prefix*" and
+# "*suffix" segments are dict lookups, other globs are compiled regexes.
+#
+# A pattern matches a path if it matches the path or one of its parent dirs,
+# "*" does not match "/", "**" matches any amount of dirs. Patterns without
+# a "/" (other than a trailing one) match in any dir, like in gitlab.
+#
+# codeowners.py
+#   Verify that all entries of CODEOWNERS exist and that directories end
+#   with a slash.
+
+import fnmatch
+import re
+import sys
+
+# Same dir
+import common
+import tree_inventory
+
+
+class Entry:
+    """ One line of CODEOWNERS. """
+
+    def __init__(self, pattern, owners, line):
+        """ :param pattern: e.g. "device/*/*-pine64-pinephone/"
+            :param owners: list of nicknames, e.g. ["@craftyguy", …]
+            :param line: line number in CODEOWNERS """
+        self.pattern = pattern
+        self.owners = owners
+        self.line = line
+
+    @property
+    def specificity(self):
+        """ Amount of literal characters in the pattern, used to find the
+            entry that matches a path most closely. """
+        return len(self.pattern) - self.pattern.count("*") - \
+            self.pattern.count("?")
+
+
+class Node:
+    """ Node of the trie, reached after matching some path segments. """
+
+    def __init__(self, is_globstar=False):
+        """ :param is_globstar: node for a "**" segment, it stays active for
+                                any amount of path segments """
+        self.is_globstar = is_globstar
+        self.literal = {}
+        self.prefix = {}
+        self.prefix_lengths = set()
+        self.suffix = {}
+        self.suffix_lengths = set()
+        self.star = None
+        self.globstar = None
+        self.globs = []  # list of (compiled regex, Node)
+        self.entries = []  # indexes of entries whose pattern ends here
+
+    def child(self, segment):
+        """ :returns: child node for a pattern segment, created if missing """
+        if segment == "**":
+            self.globstar = self.globstar or Node(True)
+            return self.globstar
+        if segment == "*":
+            self.star = self.star or Node()
+            return self.star
+
+        wildcards = segment.count("*")
+        if not wildcards and not any(c in segment for c in "?["):
+            return self.literal.setdefault(segment, Node())
+        if wildcards == 1 and not any(c in segment for c in "?["):
+            if segment.endswith("*"):
+                self.prefix_lengths.add(len(segment) - 1)
+                return self.prefix.setdefault(segment[:-1], Node())
+            if segment.startswith("*"):
+                self.suffix_lengths.add(len(segment) - 1)
+                return self.suffix.setdefault(segment[1:], Node())
+
+        regex = re.compile(fnmatch.translate(segment))
+        for glob_regex, node in self.globs:
+            if glob_regex.pattern == regex.pattern:
+                return node
+        node = Node()
+        self.globs.append((regex, node))
+        return node
+
+    def match(self, segment):
+        """ :returns: list of child nodes that match one path segment """
+        ret = []
+        if segment in self.literal:
+            ret.append(self.literal[segment])
+        for length in self.prefix_lengths:
+            if len(segment) >= length and segment[:length] in self.prefix:
+                ret.append(self.prefix[segment[:length]])
+        for length in self.suffix_lengths:
+            if len(segment) >= length and \
+                    segment[len(segment) - length:] in self.suffix:
+                ret.append(self.suffix[segment[len(segment) - length:]])
+        if self.star and segment:
+            ret.append(self.star)
+        for regex, node in self.globs:
+            if regex.match(segment):
+                ret.append(node)
+        return ret
+
+
+def closure(nodes):
+    """ :param nodes: set of active nodes
+        :returns: nodes plus the "**" children, which match zero dirs """
+    ret = set(nodes)
+    todo = list(nodes)
+    while todo:
+        node = todo.pop()
+        if node.globstar and node.globstar not in ret:
+            ret.add(node.globstar)
+            todo.append(node.globstar)
+    return frozenset(ret)
+
+
+class Codeowners:
+    """ All entries of a CODEOWNERS file, compiled into a trie. """
+
+    def __init__(self, path=None):
+        """ :param path: full path to the CODEOWNERS file, default is the one
+                         in the pmaports dir """
+        if not path:
+            path = f"{common.get_pmaports_dir()}/CODEOWNERS"
+
+        self.entries = []
+        self.root = Node()
+        with open(path) as handle:
+            for number, line in enumerate(handle, 1):
+                line = line.rstrip()
+                if not line or line.startswith("#"):
+                    continue
+                words = line.split()
+                owners = [word for word in words[1:] if word.startswith("@")]
+                self.add(Entry(words[0], owners, number))
+
+        # Parent dir => active nodes after walking it, see _walk()
+        self.cache = {"": closure({self.root})}
+
+    def add(self, entry):
+        """ Add an entry to the trie. """
+        pattern = entry.pattern.rstrip("/")
+        if pattern.startswith("/"):
+            pattern = pattern[1:]
+        elif "/" not in pattern:
+            pattern = f"**/{pattern}"
+
+        node = self.root
+        for segment in pattern.split("/"):
+            node = node.child(segment)
+        node.entries.append(len(self.entries))
+        self.entries.append(entry)
+
+    def _walk(self, path):
+        """ :param path: relative path, e.g. "main/hello-world/APKBUILD"
+            :returns: set of active nodes after matching all segments. The
+                      results for parent dirs are cached, so paths in the
+                      same dir only cost one step each. """
+        if path in self.cache:
+            return self.cache[path]
+        parent, _, name = path.rpartition("/")
+        nodes = set()
+        for node in self._walk(parent):
+            nodes.update(node.match(name))
+            if node.is_globstar:
+                nodes.add(node)
+        ret = closure(nodes)
+        self.cache[path] = ret
+        return ret
+
+    def matching_entries(self, path, exact=False):
+        """ :param path: relative path of a file or dir
+            :param exact: only return entries that match the path itself, not
+                          one of its parent dirs
+            :returns: list of matching entries, in the order of CODEOWNERS """
+        path = path.strip("/")
+        paths = [path]
+        if not exact:
+            segments = path.split("/")
+            paths = ["/".join(segments[:i + 1])
+                     for i in range(len(segments))]
+
+        indexes = set()
+        for current in paths:
+            for node in self._walk(current):
+                indexes.update(node.entries)
+        return [self.entries[i] for i in sorted(indexes)]
+
+    def owners(self, path):
+        """ :param path: relative path of a file or dir
+            :returns: owners of the entry that matches the path most closely
+                      (most literal characters, the later entry if equal), or
+                      an empty list """
+        entries = self.matching_entries(path)
+        if not entries:
+            return []
+        return max(entries, key=lambda e: (e.specificity, e.line)).owners
+
+    def owners_union(self, path):
+        """ :param path: relative path of a file or dir
+            :returns: set of owners of all entries matching the path """
+        ret = set()
+        for entry in self.matching_entries(path):
+            ret.update(entry.owners)
+        return ret
+
+    def owners_many(self, paths, union=False):
+        """ :param paths: relative paths of files or dirs
+            :param union: see owners_union(), otherwise owners()
+            :returns: dict of path => owners """
+        query = self.owners_union if union else self.owners
+        return {path: query(path) for path in paths}
+
+    def check_entries(self, inventory):
+        """ Check that each entry matches a file or dir in pmaports, and that
+            entries for dirs end with a slash.
+
+            :param inventory: tree_inventory.Inventory instance
+            :returns: list of error strings """
+        paths = {path: True for path in inventory.dirs}
+        for path, file in inventory.files.items():
+            paths[path] = file.links_to_dir
+
+        matched = set()
+        dir_entries = set()
+        for path, is_dir in paths.items():
+            for entry in self.matching_entries(path, exact=True):
+                matched.add(entry.line)
+                if is_dir:
+                    dir_entries.add(entry.line)
+
+        ret = []
+        for entry in self.entries:
+            if entry.line not in matched:
+                ret.append(f"Non-existing: {entry.pattern}")
+            elif entry.line in dir_entries and not entry.pattern.endswith("/"):
+                ret.append(f"Missing trailing slash: {entry.pattern}")
+        return ret
+
+
+if __name__ == "__main__":
+    inventory = tree_inventory.Inventory(common.get_pmaports_dir())
+    errors = Codeowners().check_entries(inventory)
+    for error in errors:
+        print(error)
+    if errors:
+        print()
+        print("ERROR: Invalid CODEOWNERS entries, see above.")
+        print()
+        sys.exit(1)
+    print("CODEOWNERS entries are valid")
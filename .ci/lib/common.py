@@ -2,8 +2,11 @@
 # Copyright 2021 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-# Various functions used in CI scripts
+# Various functions used in CI scripts. Every CI script and the pre-commit
+# hook import this, so modules from the same dir get imported in the
+# functions that need them.
 
+import atexit
 import configparser
 import os
 import subprocess
@@ -24,15 +27,116 @@ def get_pmaports_dir():
 
 def run_git(parameters, check=True, stderr=None):
     """ Run git in the pmaports dir and return the output """
+    import instrumentation
+
     cmd = ["git", "-C", get_pmaports_dir()] + parameters
     try:
-        return subprocess.check_output(cmd, stderr=stderr).decode()
+        with instrumentation.measure("git", parameters[0]):
+            return subprocess.check_output(cmd, stderr=stderr).decode()
     except subprocess.CalledProcessError:
         if check:
             raise
         return None
 
 
+class GitObjectReader:
+    """ Read objects from the pmaports git repository through one long-lived
+        'git cat-file --batch' process, instead of running 'git show' and
+        'git rev-parse' once per object. """
+
+    def __init__(self):
+        self.process = subprocess.Popen(["git", "-C", get_pmaports_dir(),
+                                         "cat-file", "--batch"],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+
+    def _request(self, name):
+        """ Look up one object and read its contents from the pipe.
+
+            :param name: object name, e.g. "HEAD" or "upstream/master:README"
+            :returns: (object id, contents as bytes), or (None, None) if the
+                      object does not exist """
+        self.process.stdin.write(name.encode() + b"\n")
+        self.process.stdin.flush()
+
+        # "<oid> <type> <size>", or "<name> missing" / "<name> ambiguous"
+        header = self.process.stdout.readline().decode().rstrip("\n")
+        if not header:
+            raise RuntimeError("git cat-file exited unexpectedly")
+        if header.endswith((" missing", " ambiguous")):
+            return None, None
+        oid, _, size = header.split(" ")
+        contents = self.process.stdout.read(int(size) + 1)[:-1]
+        return oid, contents
+
+    def read(self, revision, path=None):
+        """ :param revision: e.g. "HEAD" or "upstream/master"
+            :param path: file in the revision, e.g. "main/hello-world/APKBUILD".
+                         None to read the commit object itself.
+            :returns: contents as bytes, or None if it does not exist """
+        import instrumentation
+
+        name = revision if path is None else f"{revision}:{path}"
+        with instrumentation.measure("git", "cat-file --batch"):
+            return self._request(name)[1]
+
+    def read_many(self, pairs):
+        """ :param pairs: list of (revision, path), see read()
+            :returns: list of contents (or None), in the same order """
+        return [self.read(revision, path) for revision, path in pairs]
+
+    def rev_parse(self, revision):
+        """ :returns: object id of the revision, or None if it does not
+                      exist (like 'git rev-parse --verify -q') """
+        import instrumentation
+
+        with instrumentation.measure("git", "cat-file --batch"):
+            return self._request(revision)[0]
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def get_git_object_reader():
+    """ :returns: the GitObjectReader shared by all CI scripts, started on
+                  first use and closed on exit """
+    global cache
+    if "git_object_reader" not in cache:
+        reader = GitObjectReader()
+        atexit.register(reader.close)
+        cache["git_object_reader"] = reader
+    return cache["git_object_reader"]
+
+
+def get_apkbuild_paths(revision=None):
+    """ Get the paths of all APKBUILDs with one git call, instead of
+        searching the tree for each package.
+
+        :param revision: git revision, e.g. "upstream/master". None for the
+                         working tree (including untracked files).
+        :returns: dict of pkgname to relative path, e.g.
+                  {"hello-world": "main/hello-world/APKBUILD", ...} """
+    global cache
+    key = f"apkbuild_paths:{revision}"
+    if key in cache:
+        return cache[key]
+
+    if revision is None:
+        files = run_git(["ls-files", "-z", "--cached", "--others",
+                         "--exclude-standard", "--", "*/APKBUILD"])
+    else:
+        files = run_git(["ls-tree", "-r", "-z", "--name-only", revision])
+
+    ret = {}
+    for path in files.split("\0"):
+        if path.endswith("/APKBUILD"):
+            pkgname = os.path.basename(os.path.dirname(path))
+            ret[pkgname] = path
+    cache[key] = ret
+    return ret
+
+
 def add_upstream_git_remote():
     """ Add a remote pointing to postmarketOS/pmaports. """
     run_git(["remote", "add", "upstream",
@@ -41,14 +145,19 @@ def add_upstream_git_remote():
 
 
 def commit_message_has_string(needle):
-    return needle in run_git(["show", "-s", "--format=full", "HEAD"])
+    commit = get_git_object_reader().read("HEAD")
+    return needle in commit.decode(errors="replace")
 
 
 def run_pmbootstrap(parameters, output_return=False):
     """ Run pmbootstrap with the pmaports dir as --aports """
+    import instrumentation
+
     cmd = ["pmbootstrap", "--aports", get_pmaports_dir()] + parameters
     stdout = subprocess.PIPE if output_return else None
-    result = subprocess.run(cmd, stdout=stdout, universal_newlines=True)
+    action = next((p for p in parameters if not p.startswith("-")), "")
+    with instrumentation.measure("pmbootstrap", action):
+        result = subprocess.run(cmd, stdout=stdout, universal_newlines=True)
     result.check_returncode()
     if output_return:
         return result.stdout
@@ -77,7 +186,8 @@ def get_upstream_branch():
 
     # Get branch_pmaports (e.g. "v20.05") from channels.cfg
     # https://postmarketos.org/channels.cfg
-    channels_cfg_str = run_git(["show", "upstream/master:channels.cfg"])
+    channels_cfg_str = get_git_object_reader().read("upstream/master",
+                                                    "channels.cfg").decode()
     channels_cfg = configparser.ConfigParser()
     channels_cfg.read_string(channels_cfg_str)
     assert channel in channels_cfg, \
@@ -90,6 +200,14 @@ def get_upstream_branch():
     return ret
 
 
+def path_exists(path):
+    """ os.path.exists(), counted as file stat by the instrumentation """
+    import instrumentation
+
+    with instrumentation.measure("stat", "os.path.exists"):
+        return os.path.exists(path)
+
+
 def get_changed_files(removed=True):
     """ Get all changed files and print them, as well as the branch and the
         commit that was used for the diff.
@@ -97,10 +215,15 @@ def get_changed_files(removed=True):
         :returns: set of changed files
     """
     branch_upstream = f"upstream/{get_upstream_branch()}"
-    commit_head = run_git(["rev-parse", "HEAD"])[:-1]
-    commit_upstream = run_git(["rev-parse", branch_upstream])[:-1]
+    reader = get_git_object_reader()
+    commit_head = reader.rev_parse("HEAD")
+    commit_upstream = reader.rev_parse(branch_upstream)
+    for revision, commit in [("HEAD", commit_head),
+                             (branch_upstream, commit_upstream)]:
+        if commit is None:
+            raise RuntimeError(f"Failed to resolve git revision: {revision}")
     print("commit HEAD: " + commit_head)
-    print(f"commit {branch_upstream}: f{commit_upstream}")
+    print(f"commit {branch_upstream}: {commit_upstream}")
 
     # Check if we are HEAD on the upstream branch
     if commit_head == commit_upstream:
@@ -116,7 +239,7 @@ def get_changed_files(removed=True):
     print("changed file(s):")
     for file in run_git(["diff", "--name-only", commit, "HEAD"]).splitlines():
         message = "  " + file
-        if not os.path.exists(file):
+        if not path_exists(file):
             message += " (deleted)"
             if removed:
                 ret.add(file)
@@ -126,28 +249,61 @@ def get_changed_files(removed=True):
     return ret
 
 
-def get_changed_packages_sanity_check(count):
+def get_changed_packages_sanity_check(packages, arch=None, apkbuilds=None):
+    """ Make sure that building the changed packages doesn't take longer than
+        the time budget, based on the recorded build times (see
+        build_times.py).
+
+        :param packages: changed pkgnames
+        :param arch: architecture they get built for, None to estimate the
+                     slowest arch
+        :param apkbuilds: dict of pkgname => parsed APKBUILD of the packages,
+                          to estimate the time of building them in parallel
+                          slots like build_scheduler.py does it (with
+                          PMAPORTS_CI_BUILD_JOBS). Without it, the estimate is
+                          for building them one after another. """
+    import build_scheduler
+    import build_times
+
     for mark in ["[ci:ignore-count]", "[ci:skip-build]"]:
         if commit_message_has_string(mark):
             print("NOTE: package count sanity check skipped (" + mark + ").")
             return
-    if count <= 10:
+
+    times = build_times.BuildTimes()
+    budget = build_times.get_budget()
+    if apkbuilds is not None:
+        total = build_scheduler.predict_duration(apkbuilds, arch, times=times)
+    else:
+        total = times.predict_total(packages, arch)
+    if total <= budget:
         return
 
     branch = get_upstream_branch()
+    estimates = sorted(((times.predict(pkgname, arch), pkgname)
+                        for pkgname in packages), reverse=True)
+    print("Estimated build times:")
+    for seconds, pkgname in estimates:
+        print(f"  {pkgname}: {build_times.format_duration(seconds)}")
+    slots = ""
+    if apkbuilds is not None and build_scheduler.get_jobs() > 1:
+        slots = f" (in {build_scheduler.get_jobs()} parallel slots)"
     print(f"""
-ERROR: Too many packages have changed!
+ERROR: Building the changed packages would take too long!
+
+Estimated: {build_times.format_duration(total)}{slots}
+Budget: {build_times.format_duration(budget)}
 
 This is a sanity check, so we don't end up building packages that
-have not been modified. CI won't run for more than three hours
-anyway.
+have not been modified, or waiting for builds that can't finish in
+time.
 
 Your options:
 a) If you *did not* modify everything listed above, then rebase
    your branch on the official postmarketOS/pmaports.git {branch}
    branch. Feel free to ask in the chat for help if you need any.
 b) If you *did* modify all these packages, and you assume that
-   they will build within one hour: skip this sanity check by
+   they will build in time anyway: skip this sanity check by
    adding '[ci:ignore-count]' to the commit message of the last
    commit in the merge request (then force push).
 c) If you *did* modify all these packages, and you are sure that
@@ -161,43 +317,106 @@ Thank you and sorry for the inconvenience.
     sys.exit(1)
 
 
-def get_changed_packages():
-    ret = set()
-    for file in get_changed_files():
-        dirname, filename = os.path.split(file)
-
-        # Skip files:
-        # * in the root dir of pmaports (e.g. README.md)
-        # * path with a dot (e.g. .ci/, device/.shared-patches/)
-        if not dirname or file.startswith(".") or "/." in file:
-            continue
-
-        if filename != "APKBUILD":
-            # Walk up directories until we (eventually) find the package
-            # the file belongs to (could be in a subdirectory of a package)
-            while dirname and not os.path.exists(os.path.join(dirname, "APKBUILD")):
-                dirname = os.path.dirname(dirname)
-
-            # Unable to find APKBUILD the file belong to
-            if not dirname:
-                # ... maybe the package was deleted entirely?
-                if not os.path.exists(file):
-                    continue
-
-                # Weird, file does not belong to any package?
-                # Here we just warn, there is an extra check
-                # to make sure that files are organized properly.
-                print(f"WARNING: Changed file {file} does not belong to any package")
-                continue
-
-        elif not os.path.exists(file):
-            continue  # APKBUILD was deleted
-
-        ret.add(os.path.basename(dirname))
+def get_package_dir(file):
+    """ Find the package a file belongs to.
 
+        :param file: path relative to the pmaports dir
+        :returns: relative path of the package dir (e.g. "main/hello-world"),
+                  or None if the file doesn't belong to an existing package
+    """
+    pmaports_dir = get_pmaports_dir()
+    dirname, filename = os.path.split(file)
+
+    # Skip files:
+    # * in the root dir of pmaports (e.g. README.md)
+    # * path with a dot (e.g. .ci/, device/.shared-patches/)
+    if not dirname or file.startswith(".") or "/." in file:
+        return None
+
+    if filename != "APKBUILD":
+        # Walk up directories until we (eventually) find the package
+        # the file belongs to (could be in a subdirectory of a package)
+        while dirname and not path_exists(os.path.join(pmaports_dir, dirname, "APKBUILD")):
+            dirname = os.path.dirname(dirname)
+
+        # Unable to find APKBUILD the file belong to
+        if not dirname:
+            # ... maybe the package was deleted entirely?
+            if not path_exists(os.path.join(pmaports_dir, file)):
+                return None
+
+            # Weird, file does not belong to any package?
+            # Here we just warn, there is an extra check
+            # to make sure that files are organized properly.
+            print(f"WARNING: Changed file {file} does not belong to any package")
+            return None
+
+    elif not path_exists(os.path.join(pmaports_dir, file)):
+        return None  # APKBUILD was deleted
+
+    return dirname
+
+
+def get_symlink_index():
+    """ :returns: symlink_index.SymlinkIndex of all symlinks in the git index
+                  (mode 120000), found with one git call instead of a walk
+                  over the whole tree """
+    import symlink_index
+
+    global cache
+    if "symlink_index" in cache:
+        return cache["symlink_index"]
+
+    links = []
+    for entry in run_git(["ls-files", "-s", "-z"]).split("\0"):
+        if entry.startswith("120000 "):
+            links.append(entry.split("\t", 1)[1])
+    ret = symlink_index.SymlinkIndex(get_pmaports_dir(), links)
+    cache["symlink_index"] = ret
     return ret
 
 
+def get_symlinked_package_dirs(files):
+    """ Find the packages that use files through symlinks, e.g. kernels
+        with a symlink to a patch in device/.shared-patches.
+
+        :param files: relative paths of changed files
+        :returns: dict of file => set of relative package dirs, only for
+                  files that are used through symlinks """
+    ret = {}
+    for file, links in get_symlink_index().get_links_many(files).items():
+        package_dirs = {get_package_dir(link) for link in links}
+        package_dirs.discard(None)
+        if package_dirs:
+            ret[file] = package_dirs
+    return ret
+
+
+def get_changed_package_dirs(files=None):
+    """ :param files: changed files, or None to use get_changed_files()
+        :returns: set of relative package dirs, e.g. {"main/hello-world"},
+                  including packages with symlinks to changed files """
+    if files is None:
+        files = get_changed_files()
+
+    ret = set()
+    for file in files:
+        package_dir = get_package_dir(file)
+        if package_dir:
+            ret.add(package_dir)
+
+    for file, package_dirs in sorted(get_symlinked_package_dirs(files).items()):
+        print(f"{file} is used through symlinks by: "
+              f"{', '.join(sorted(package_dirs))}")
+        ret |= package_dirs
+    return ret
+
+
+def get_changed_packages():
+    return {os.path.basename(package_dir)
+            for package_dir in get_changed_package_dirs()}
+
+
 def get_changed_kernels():
     ret = []
     for pkgname in get_changed_packages():
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Read all deviceinfo files once into one table of device x key, and check
+# them with rules that work on whole columns (e.g. all values of
+# deviceinfo_arch) instead of parsing each file on its own. Values get
+# tokenized like pmb.parse.deviceinfo() does it: lines starting with
+# "deviceinfo_" are split at the first "=" and the quotes are removed.
+#
+# deviceinfo_table.py KEY
+#   Print the value of KEY for all devices that set it.
+
+import os
+import re
+import sys
+
+# Same dir
+import common
+import instrumentation
+
+# pmbootstrap
+import add_pmbootstrap_to_import_path  # noqa
+import pmb.config
+# pmb.parse.deviceinfo is also the name of the parse function in pmb.parse,
+# which hides the module
+from pmb.parse.deviceinfo import sanity_check
+
+line_re = re.compile("^deviceinfo_[a-zA-Z0-9_]*=\".*\"$")
+
+# Options that must not be used anymore. They must still be defined in
+# pmbootstrap's config/__init__.py.
+obsolete_options = [
+    "usb_rndis_function",
+    "weston_pixman_type",
+]
+
+
+def tokenize(content):
+    """ :param content: text of a deviceinfo file
+        :returns: (values, errors): dict of key => value (without the
+                  "deviceinfo_" prefix and without quotes), list of syntax
+                  error strings """
+    values = {}
+    errors = []
+    for line in content.split("\n"):
+        # Require space after # for comments
+        if line.startswith("#") and not line.startswith("# "):
+            errors.append(f"Comment style: please change '#' to '# ': {line}")
+            continue
+
+        # Skip empty lines and comments
+        if not line or line.startswith("# "):
+            continue
+
+        # Variable can not be empty
+        if '=""' in line:
+            errors.append(f"Please remove the empty variable: {line}")
+        # Check line against regex (can't use multiple lines etc.)
+        elif not line_re.match(line) or line.endswith("\\\""):
+            errors.append("Line looks invalid, maybe missing quotes/multi-line"
+                          " string/comment next to line instead of above?"
+                          f" {line}")
+
+        line = line.strip()
+        if line.startswith("deviceinfo_") and "=" in line:
+            key, value = line[len("deviceinfo_"):].split("=", 1)
+            values[key] = value.replace("\"", "")
+    return values, errors
+
+
+class DeviceinfoTable:
+    """ Tokenized deviceinfo files of many devices, stored per key. """
+
+    def __init__(self, pmaports_dir, package_dirs):
+        """ :param pmaports_dir: full path to the pmaports dir
+            :param package_dirs: relative paths to the device packages, e.g.
+                                 ["device/main/device-qemu-amd64", …] """
+        self.pmaports_dir = pmaports_dir
+
+        # Device (codename from the package dir) => relative package dir
+        self.package_dirs = {}
+
+        # Key => device => value
+        self.columns = {}
+
+        # Device => list of syntax error strings
+        self.syntax_errors = {}
+
+        for package_dir in package_dirs:
+            device = os.path.basename(package_dir)[len("device-"):]
+            path = f"{pmaports_dir}/{package_dir}/deviceinfo"
+            with open(path) as handle, \
+                    instrumentation.measure("parse", "deviceinfo"):
+                values, errors = tokenize(handle.read())
+            self.package_dirs[device] = package_dir
+            if errors:
+                self.syntax_errors[device] = errors
+            for key, value in values.items():
+                self.columns.setdefault(key, {})[device] = value
+
+    @property
+    def devices(self):
+        """ :returns: sorted list of all devices in the table """
+        return sorted(self.package_dirs)
+
+    def column(self, key):
+        """ :param key: without the "deviceinfo_" prefix, e.g. "arch"
+            :returns: dict of device => value, for devices that set the key """
+        return self.columns.get(key, {})
+
+    def get(self, device, key, default=""):
+        """ :returns: value of one key, default if the device doesn't set it """
+        return self.column(key).get(device, default)
+
+    def row(self, device):
+        """ :returns: dict of key => value of one device, with "" for the
+                      deviceinfo attributes it doesn't set (like
+                      pmb.parse.deviceinfo() returns it) """
+        ret = dict.fromkeys(pmb.config.deviceinfo_attributes, "")
+        for key, values in self.columns.items():
+            if device in values:
+                ret[key] = values[device]
+        return ret
+
+    def path(self, device):
+        """ :returns: full path to the deviceinfo file of the device """
+        return f"{self.pmaports_dir}/{self.package_dirs[device]}/deviceinfo"
+
+    def devices_with(self, key):
+        """ :returns: sorted list of devices that set the key to a value that
+                      is not empty """
+        return sorted(device for device, value in self.column(key).items()
+                      if value)
+
+
+def rule_syntax(table, apkbuilds):
+    """ Comment style, empty variables and lines that can't be parsed. """
+    return [(device, error)
+            for device, errors in table.syntax_errors.items()
+            for error in errors]
+
+
+def rule_obsolete(table, apkbuilds):
+    """ Options that got removed or renamed. """
+    ret = []
+    for option in obsolete_options:
+        for device in table.devices_with(option):
+            ret.append((device, f"option {option} is obsolete, please rename"
+                        " or remove it (see reasons for removal of at"
+                        " https://postmarketos.org/deviceinfo)"))
+    return ret
+
+
+def get_kernels(apkbuilds, table, device):
+    """ :returns: kernels the device can be used with, from the
+                  device-<codename>-kernel-* subpackages of its APKBUILD
+                  (like pmb.parse._apkbuild.kernels()), or [None] for devices
+                  with only one kernel """
+    prefix = f"device-{device}-kernel-"
+    subpackages = apkbuilds.get(table.package_dirs[device])["subpackages"]
+    return [subpkgname[len(prefix):] for subpkgname in subpackages
+            if subpkgname.startswith(prefix)] or [None]
+
+
+def parse_kernel_suffix(info, kernel):
+    """ Select the values of one kernel, like
+        pmb.parse.deviceinfo._parse_kernel_suffix() does for the kernel
+        chosen in 'pmbootstrap init'.
+
+        :param info: see DeviceinfoTable.row()
+        :param kernel: e.g. "mainline", None to return info as it is
+        :returns: info, with e.g. the value of "dtb_mainline" moved to
+                  "dtb" """
+    if not kernel:
+        return info
+    ret = dict(info)
+    suffix = kernel.replace("-", "_")
+    for key in pmb.config.deviceinfo_attributes:
+        if f"{key}_{suffix}" in ret:
+            ret[key] = ret.pop(f"{key}_{suffix}")
+    return ret
+
+
+def rule_sanity(table, apkbuilds):
+    """ pmb.parse.deviceinfo.sanity_check() (removed options, required
+        codename, chassis and arch) for each kernel of the device. """
+    ret = []
+    for device in table.devices:
+        try:
+            kernels = get_kernels(apkbuilds, table, device)
+        except (RuntimeError, ValueError) as e:
+            ret.append((device, f"failed to parse the APKBUILD: {e}"))
+            continue
+
+        # Error message => kernels it happens with
+        errors = {}
+        for kernel in kernels:
+            info = parse_kernel_suffix(table.row(device), kernel)
+            try:
+                sanity_check(info, table.path(device))
+            except RuntimeError as e:
+                errors.setdefault(str(e), []).append(kernel)
+
+        for error, failed in errors.items():
+            if failed != kernels:
+                error += f" (with kernel {', '.join(failed)})"
+            ret.append((device, error))
+    return ret
+
+
+def rule_manufacturer(table, apkbuilds):
+    """ deviceinfo_name must start with the manufacturer. """
+    ret = []
+    manufacturers = table.column("manufacturer")
+    for device, name in table.column("name").items():
+        manufacturer = manufacturers.get(device, "")
+        if not name.startswith(manufacturer) and \
+                not name.startswith("Google"):
+            ret.append((device, "Please add the manufacturer in front of the"
+                        f" deviceinfo_name, e.g.: '{manufacturer} {name}'"))
+    return ret
+
+
+def rule_arch(table, apkbuilds):
+    """ arch= of the device APKBUILD must be deviceinfo_arch. """
+    ret = []
+    for device, arch in table.column("arch").items():
+        package_dir = table.package_dirs[device]
+        try:
+            apkbuild = apkbuilds.get(package_dir)
+        except (RuntimeError, ValueError) as e:
+            ret.append((device, f"failed to parse the APKBUILD: {e}"))
+            continue
+        if arch and "".join(apkbuild["arch"]) != arch:
+            ret.append((device, "wrong architecture, please change to"
+                        f" arch=\"{arch}\": {apkbuilds.path(package_dir)}"))
+    return ret
+
+
+rules = [
+    rule_syntax,
+    rule_obsolete,
+    rule_sanity,
+    rule_manufacturer,
+    rule_arch,
+]
+
+
+def check(table, apkbuilds, rules=rules):
+    """ :param table: DeviceinfoTable instance
+        :param apkbuilds: apkbuild_index.ApkbuildIndex instance
+        :returns: list of error strings like "qemu-amd64: …", sorted by
+                  device """
+    errors = []
+    for rule in rules:
+        errors += rule(table, apkbuilds)
+    return [f"{device}: {error}" for device, error
+            in sorted(errors, key=lambda error: error[0])]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(f"usage: {sys.argv[0]} KEY")
+        sys.exit(1)
+
+    pmaports_dir = common.get_pmaports_dir()
+    package_dirs = [os.path.dirname(path)
+                    for path in common.get_apkbuild_paths().values()
+                    if os.path.exists(f"{pmaports_dir}/"
+                                      f"{os.path.dirname(path)}/deviceinfo")]
+    table = DeviceinfoTable(pmaports_dir, package_dirs)
+    for device, value in sorted(table.column(sys.argv[1]).items()):
+        print(f"{device}: {value}")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Index of all files that get downloaded via source= in pmaports. apk caches
+# them in a flat distfiles directory, so the filenames need to be unique.
+
+import os
+
+# Same dir
+import checksums
+
+
+class DistfilesIndex:
+    """ All remote source files of all APKBUILDs with their checksums, built
+        in one pass over the tree. Files bundled with a package (local
+        sources) don't end up in the distfiles cache and are not part of it.
+    """
+
+    def __init__(self, apkbuilds, inventory):
+        """ :param apkbuilds: apkbuild_index.ApkbuildIndex (only used for the
+                              list of packages, APKBUILDs don't get parsed)
+            :param inventory: tree_inventory.Inventory, for the local files
+                              of each package """
+        # Relative package dir => set of file names in the package dir
+        # (including subdirs)
+        self.local_files = {}
+
+        # Filename => {"checksum": "b4dc4f3…",
+        #              "apkbuilds": ["main/hello-world/APKBUILD", ...]}
+        self.distfiles = {}
+
+        # List of (filename, first, other), where first and other are
+        # (checksum, apkbuild_rel) of two APKBUILDs with different checksums
+        self.conflicts = []
+
+        for package_dir in apkbuilds.package_dirs:
+            self.local_files[package_dir] = {
+                os.path.basename(file.path)
+                for file in inventory.package_files(package_dir)}
+            self.add(apkbuilds.path(package_dir), package_dir)
+
+    def add(self, apkbuild_path, package_dir):
+        """ Add the remote sources of one APKBUILD to the index. """
+        apkbuild_rel = f"{package_dir}/APKBUILD"
+        local_files = self.local_files[package_dir]
+        source = checksums.parse_source_from_checksums(apkbuild_path)
+
+        for filename, checksum in source.items():
+            if filename in local_files:
+                continue
+
+            # First time seeing this file
+            distfile = self.distfiles.get(filename)
+            if not distfile:
+                self.distfiles[filename] = {"checksum": checksum,
+                                            "apkbuilds": [apkbuild_rel]}
+                continue
+
+            # Saw this file already with same checksum
+            if checksum == distfile["checksum"]:
+                distfile["apkbuilds"].append(apkbuild_rel)
+                continue
+
+            # Saw this file already with different checksum
+            first = (distfile["checksum"], distfile["apkbuilds"][0])
+            self.conflicts.append((filename, first, (checksum, apkbuild_rel)))
+
+    def items(self):
+        """ :returns: sorted list of (filename, checksum, apkbuilds) for all
+                      distfiles, where apkbuilds is the list of APKBUILDs that
+                      reference the file """
+        return [(filename, distfile["checksum"], distfile["apkbuilds"])
+                for filename, distfile in sorted(self.distfiles.items())]
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Check the contents of all files in pmaports for bad patterns. Each file is
+# read once and searched for the strings of all rules that apply to it. The
+# matching lines only get collected for files where that finds something.
+# Fixed strings are used instead of one combined regex, because bytes.find()
+# is much faster than python's re with many alternatives.
+#
+# grep_rules.py
+#   Check all files, print the errors and exit with 1 if there are any.
+
+import fnmatch
+import re
+import sys
+
+# Same dir
+import common
+import tree_inventory
+
+# Rules for bad patterns:
+# * strings: fixed strings (bytes) to look for
+# * message: lines to print before the matching lines
+# * paths: fnmatch patterns of the files to check, relative to the pmaports
+#   dir (default: all files, except for hidden dirs in the top dir like .ci)
+# * exclude: fnmatch patterns of file and dir names to skip
+rules = [
+    {
+        "strings": [b"(CHANGEME!)"],
+        "message": ["ERROR: Please replace '(CHANGEME!)' in the following"
+                    " files:"],
+    },
+    {
+        "strings": [b'INSTALL_DTBS_PATH="$pkgdir"/usr/share/dtb'],
+        "message": ["ERROR: Please do not install dtbs to /usr/share/dtb!",
+                    "ERROR: Unless you have a good reason not to, please put"
+                    " them in /boot/dtbs",
+                    "ERROR: Files that need fixing:"],
+        "paths": ["device/*"],
+    },
+    # Old mkinitfs paths (pre mkinitfs 2.0)
+    {
+        "strings": [b"/etc/postmarketos-mkinitfs"],
+        "message": ["ERROR: Please replace '/etc/postmarketos-mkinitfs' with"
+                    " '/usr/share/mkinitfs' in the following files:"],
+    },
+    {
+        "strings": [b"/usr/share/postmarketos-mkinitfs"],
+        "message": ["ERROR: Please replace '/usr/share/postmarketos-mkinitfs'"
+                    " with '/usr/share/mkinitfs' in the following files:"],
+    },
+    {
+        "strings": [b"source /etc/deviceinfo", b". /etc/deviceinfo"],
+        "message": ["ERROR: Please source the source_deviceinfo script"
+                    " instead of sourcing deviceinfo directly!"],
+        "exclude": ["source_deviceinfo",
+                    "rootfs-usr-share-misc-source_deviceinfo"],
+    },
+    {
+        "strings": [b"deviceinfo_modules_initfs"],
+        "message": ["ERROR: deviceinfo_modules_initfs variable has been"
+                    " removed. Use \"modules-initfs\" file instead."],
+    },
+    # The excluded devices are "grandfathered in". New devices should not be
+    # added here. See https://gitlab.com/postmarketOS/pmaports/-/issues/2529
+    {
+        "strings": [b"/usr/share/wallpapers/postmarketos.jpg"],
+        "message": ["ERROR: Please don't include configuration files that set"
+                    " the default wallpaper in device-specific packages!"],
+        "paths": ["device/*"],
+        "exclude": ["device-pine64-pinetab",
+                    "device-oneplus-kebab",
+                    "device-xiaomi-willow"],
+    },
+    {
+        "strings": [b"before wpa_supplicant"],
+        "message": ["ERROR: Please use 'before wlan' in OpenRC service files!"
+                    " This ensures compatibility with both wpa_supplicant and"
+                    " iwd."],
+        "paths": ["*.initd"],
+    },
+    {
+        "strings": [b"PMOS_NO_OUTPUT_REDIRECT"],
+        "message": ["ERROR: PMOS_NO_OUTPUT_REDIRECT is deprecated and doesn't"
+                    " do anything.",
+                    "Please remove it from the following files:"],
+    },
+]
+
+
+def compile_patterns(patterns):
+    """ :param patterns: list of fnmatch patterns
+        :returns: one compiled regex matching any of them, or None """
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
+
+def get_matching_lines(data, strings):
+    """ :param data: contents of the file
+        :param strings: see rules
+        :returns: list of (line number, line) """
+    starts = set()
+    for string in strings:
+        pos = data.find(string)
+        while pos != -1:
+            starts.add(data.rfind(b"\n", 0, pos) + 1)
+            pos = data.find(string, pos + 1)
+
+    ret = []
+    line_number = 1
+    line_pos = 0
+    for start in sorted(starts):
+        line_number += data.count(b"\n", line_pos, start)
+        line_pos = start
+        end = data.find(b"\n", start)
+        if end == -1:
+            end = len(data)
+        ret.append((line_number, data[start:end]))
+    return ret
+
+
+class Scanner:
+    """ Check files for all rules in one pass. """
+
+    def __init__(self, rules=rules):
+        self.rules = rules
+        self.paths = [compile_patterns(rule.get("paths")) for rule in rules]
+        self.exclude = [compile_patterns(rule.get("exclude"))
+                        for rule in rules]
+
+        # Rule index => list of (path, [(line number, line), …])
+        self.found = {}
+
+    def rule_applies(self, i, path):
+        """ :param i: index of the rule
+            :param path: relative path of the file
+            :returns: True if the file needs to be checked for the rule """
+        if self.paths[i]:
+            if not self.paths[i].match(path):
+                return False
+        elif path.startswith("."):
+            return False
+
+        if self.exclude[i]:
+            return not any(self.exclude[i].match(name)
+                           for name in path.split("/"))
+        return True
+
+    def scan_file(self, path, full_path):
+        """ Check one file for the rules that apply to it. """
+        indexes = [i for i in range(len(self.rules))
+                   if self.rule_applies(i, path)]
+        if not indexes:
+            return
+
+        with open(full_path, "rb") as handle:
+            data = handle.read()
+        for i in indexes:
+            if not any(string in data for string in self.rules[i]["strings"]):
+                continue
+            lines = get_matching_lines(data, self.rules[i]["strings"])
+            self.found.setdefault(i, []).append((path, lines))
+
+    def scan(self, inventory):
+        """ :param inventory: tree_inventory.Inventory instance """
+        for path, file in inventory.files.items():
+            # Like "grep -r", don't follow symlinks
+            if file.is_regular and file.size:
+                self.scan_file(path, f"{inventory.pmaports_dir}/{path}")
+
+    def report(self):
+        """ Print the errors.
+
+            :returns: True if no rule found anything """
+        for i, found in sorted(self.found.items()):
+            for line in self.rules[i]["message"]:
+                print(line)
+            for path, lines in found:
+                for line_number, line in lines:
+                    line = line.decode("utf-8", errors="replace")
+                    print(f"{path}:{line_number}:{line}")
+        return not self.found
+
+
+if __name__ == "__main__":
+    scanner = Scanner()
+    scanner.scan(tree_inventory.Inventory(common.get_pmaports_dir()))
+    if not scanner.report():
+        sys.exit(1)
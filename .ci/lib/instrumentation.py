@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Opt-in instrumentation of the hot paths of the CI scripts, to find out
+# where the time of the pytest and commits stages goes. Set
+# PMAPORTS_CI_PROFILE to the path of a JSON file to enable it. Then:
+#
+# * git and pmbootstrap calls, APKBUILD and deviceinfo parses, file stats
+#   and walks over the tree get counted and timed with measure()
+# * the wall time and the memory get recorded for each scope: the testcase
+#   (or the script outside of pytest) and the phase in it (e.g. "setup",
+#   "fixture:apkbuilds", "call"). By default, that is how much the peak RSS
+#   of the process grew in the scope. Set PMAPORTS_CI_PROFILE_MEMORY too, to
+#   record the peak of the Python allocations in each scope with
+#   tracemalloc. That makes parsing several times slower, so only compare
+#   timings of runs with the same settings.
+#
+# At exit, the results of the process get appended to the JSON file (so the
+# scripts of one CI job end up in the same file) and a summary of the top
+# entries gets printed. Without PMAPORTS_CI_PROFILE, measure() returns a
+# shared no-op context manager and nothing else happens.
+#
+# Work done in the worker processes of parallel.map_ordered() is only
+# recorded as one "parallel" entry in the parent process.
+
+import atexit
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+# Path of the JSON file, None if the instrumentation is disabled
+path = os.environ.get("PMAPORTS_CI_PROFILE") or None
+enabled = path is not None
+trace_memory = enabled and bool(os.environ.get("PMAPORTS_CI_PROFILE_MEMORY"))
+
+# Amount of entries per table in the summary
+top = 10
+
+# (test, phase) => {"seconds": float, "rss_growth": bytes,
+#                   "peak_memory": bytes or None without trace_memory}
+scopes = {}
+
+# (test, phase, category, name) => [count, seconds]
+calls = {}
+
+# Current scope: the test and the stack of nested phases
+current_test = os.path.basename(sys.argv[0]) if sys.argv else "python"
+phases = []
+last_switch = time.monotonic()
+last_max_rss = 0
+started = time.monotonic()
+finished = False
+
+_disabled = contextlib.nullcontext()
+
+
+def get_scope():
+    """ :returns: (test, phase) that gets the current measurements """
+    return current_test, phases[-1] if phases else "main"
+
+
+def get_max_rss():
+    """ :returns: peak resident set size of this process in bytes """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def switch_scope(update):
+    """ Account the time and memory since the last switch to the current
+        scope, then change the scope.
+
+        :param update: function that changes current_test or phases """
+    global last_switch
+    global last_max_rss
+
+    now = time.monotonic()
+    max_rss = get_max_rss()
+    entry = scopes.setdefault(get_scope(), {"seconds": 0.0, "rss_growth": 0,
+                                            "peak_memory": None})
+    entry["seconds"] += now - last_switch
+    entry["rss_growth"] += max_rss - last_max_rss
+    if trace_memory:
+        entry["peak_memory"] = max(entry["peak_memory"] or 0,
+                                   tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    last_switch = now
+    last_max_rss = max_rss
+    update()
+
+
+def set_test(name):
+    """ :param name: testcase that the following measurements belong to,
+                     e.g. the pytest node id. None to go back to the script
+                     name. """
+    if not enabled:
+        return
+
+    def update():
+        global current_test
+        current_test = name or os.path.basename(sys.argv[0])
+    switch_scope(update)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """ Attribute the measurements inside the block to a phase of the
+        current test, e.g. "setup" or "fixture:apkbuilds". """
+    if not enabled:
+        yield
+        return
+    switch_scope(lambda: phases.append(name))
+    try:
+        yield
+    finally:
+        switch_scope(phases.pop)
+
+
+def record(category, name, seconds, count=1):
+    """ Add a measurement to the current scope.
+
+        :param category: e.g. "git", "pmbootstrap", "parse", "stat", "walk"
+        :param name: what was called, e.g. "ls-files" or "APKBUILD"
+        :param seconds: time it took
+        :param count: amount of calls it stands for """
+    if not enabled:
+        return
+    entry = calls.setdefault(get_scope() + (category, name), [0, 0.0])
+    entry[0] += count
+    entry[1] += seconds
+
+
+class Measurement:
+    """ Context manager that records the time of its block, see
+        measure(). """
+
+    def __init__(self, category, name, count):
+        self.category = category
+        self.name = name
+        self.count = count
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.category, self.name, time.monotonic() - self.start,
+               self.count)
+
+
+def measure(category, name, count=1):
+    """ Count and time a block, e.g.:
+
+        with instrumentation.measure("git", "ls-files"):
+            ...
+
+        :param count: amount of calls the block stands for, e.g. the
+                      amount of files a walk stat'ed
+        :returns: context manager, a shared no-op one when disabled """
+    if not enabled:
+        return _disabled
+    return Measurement(category, name, count)
+
+
+def get_results():
+    """ :returns: dict with the results of this process, as stored in the
+                  JSON file """
+    peaks = [entry["peak_memory"] for entry in scopes.values()]
+    return {
+        "command": " ".join(sys.argv),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seconds": time.monotonic() - started,
+        "max_rss": get_max_rss(),
+        "peak_memory": max(peaks) if trace_memory and peaks else None,
+        "scopes": [{"test": test, "phase": phase_name, **entry}
+                   for (test, phase_name), entry in scopes.items()],
+        "calls": [{"test": test, "phase": phase_name, "category": category,
+                   "name": name, "count": count, "seconds": seconds}
+                  for (test, phase_name, category, name), (count, seconds)
+                  in calls.items()],
+    }
+
+
+def write(results):
+    """ Append the results of this process to the JSON file. """
+    runs = []
+    if os.path.exists(path):
+        try:
+            with open(path) as handle:
+                runs = json.load(handle)["runs"]
+        except (ValueError, KeyError):
+            print(f"WARNING: {path}: invalid profile, overwriting it")
+    runs.append(results)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as handle:
+        json.dump({"runs": runs}, handle, indent=1)
+
+
+def format_memory(size):
+    return f"{size / 1024 / 1024:.1f} MiB"
+
+
+def summarize(results, log=print):
+    """ Print the slowest scopes, the calls that took the most time in
+        total and the scopes that needed the most memory. """
+    log(f"profile: {results['seconds']:.2f}s, peak RSS"
+        f" {format_memory(results['max_rss'])}, written to {path}")
+
+    log(f"slowest tests/phases (top {top}):")
+    for entry in sorted(results["scopes"], key=lambda e: e["seconds"],
+                        reverse=True)[:top]:
+        log(f"  {entry['seconds']:8.2f}s  {entry['test']} ({entry['phase']})")
+
+    totals = {}
+    for entry in results["calls"]:
+        total = totals.setdefault((entry["category"], entry["name"]),
+                                  [0, 0.0])
+        total[0] += entry["count"]
+        total[1] += entry["seconds"]
+    log(f"calls by total time (top {top}):")
+    for (category, name), (count, seconds) in sorted(
+            totals.items(), key=lambda item: item[1][1], reverse=True)[:top]:
+        log(f"  {seconds:8.2f}s  {count:6}x  {category}: {name}")
+
+    key = "peak_memory" if trace_memory else "rss_growth"
+    title = "tracemalloc peaks" if trace_memory else "peak RSS growth"
+    log(f"{title} (top {top}):")
+    entries = [entry for entry in results["scopes"] if entry[key]]
+    for entry in sorted(entries, key=lambda e: e[key], reverse=True)[:top]:
+        log(f"  {format_memory(entry[key]):>12}  {entry['test']}"
+            f" ({entry['phase']})")
+
+
+def finish(log=print):
+    """ Write the results and print the summary. Called at exit, or earlier
+        by pytest to print the summary with the terminal reporter. """
+    global finished
+    if not enabled or finished:
+        return
+    finished = True
+    switch_scope(lambda: None)
+    results = get_results()
+    write(results)
+    summarize(results, log)
+
+
+if enabled:
+    # Start as early as possible, i.e. when the first CI module imports this
+    last_max_rss = get_max_rss()
+    if trace_memory:
+        tracemalloc.start()
+    atexit.register(finish)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Check kernel configs against the rules in kconfigcheck.toml without running
+# pmbootstrap, with the same semantics as "pmbootstrap kconfig check". The
+# rules get resolved once per combination of categories, kernel version and
+# architecture, so checking all kernels of pmaports only takes seconds.
+#
+# kconfigcheck.py [PKGNAME...]
+#   Check the given kernel packages, or all of them if none are given.
+
+import glob
+import os
+import sys
+import tomllib
+
+# Same dir
+import apkbuild_index
+import common
+import instrumentation
+
+# pmbootstrap
+import add_pmbootstrap_to_import_path  # noqa
+import pmb.parse.version
+
+
+def parse_config(path):
+    """ Parse a kernel config into a dict. Options that are not set (only
+        mentioned in a comment) are not part of the dict.
+
+        :param path: full path to the kernel config
+        :returns: dict of option name without the CONFIG_ prefix to the raw
+                  value, e.g. {"EXT4_FS": "y", "LSM": "\"lockdown,yama\""} """
+    ret = {}
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        for line in handle:
+            if not line.startswith("CONFIG_"):
+                continue
+            option, sep, value = line[len("CONFIG_"):].rstrip("\n").partition("=")
+            if sep:
+                # Same as pmbootstrap's regex search: first match counts
+                ret.setdefault(option, value)
+    return ret
+
+
+def get_string(config, option):
+    """ :returns: value of a string option without quotes, or None """
+    value = config.get(option)
+    if value is None or len(value) < 2 or value[0] != '"' or value[-1] != '"':
+        return None
+    return value[1:-1]
+
+
+def check_option(config, option, expected):
+    """ Check one option of a parsed kernel config.
+
+        :param config: parsed kernel config, see parse_config()
+        :param option: option name without CONFIG_ prefix, e.g. "EXT4_FS"
+        :param expected: value from kconfigcheck.toml: bool, str or list
+        :returns: None if the check passed, otherwise what the option should
+                  be, e.g. "be set" or 'contain "binder"' """
+    if isinstance(expected, bool):
+        if expected != (config.get(option) in ["y", "m"]):
+            return "be set" if expected else "*not* be set"
+    elif isinstance(expected, str):
+        if get_string(config, option) != expected:
+            return f'be set to "{expected}"'
+    elif isinstance(expected, list):
+        value = get_string(config, option)
+        values = value.split(",") if value is not None else []
+        for string in expected:
+            if string not in values:
+                return f'contain "{string}"'
+    else:
+        raise RuntimeError(f"kconfigcheck.toml: CONFIG_{option}: only"
+                           " booleans, strings and lists are supported, got:"
+                           f" {expected}")
+    return None
+
+
+class KconfigCheck:
+    """ Rules from kconfigcheck.toml, compiled into a lookup structure. """
+
+    def __init__(self, path=None):
+        """ :param path: full path to kconfigcheck.toml, default is the one
+                         in the pmaports dir """
+        if not path:
+            path = f"{common.get_pmaports_dir()}/kconfigcheck.toml"
+        with open(path, "rb") as handle:
+            toml = tomllib.load(handle)
+
+        self.aliases = toml.get("aliases", {})
+
+        # "category:default" => list of (version rules, arches, options),
+        # e.g. ([">=3.13.0", "<6.0"], ["aarch64", "armv7"], {"ZRAM": True}).
+        # Arches is None for "all".
+        self.categories = {}
+        for key, versions in toml.items():
+            if not key.startswith("category:"):
+                continue
+            sections = []
+            for version, arches_options in versions.items():
+                for arches, options in arches_options.items():
+                    sections.append((version.split(" "),
+                                     None if arches == "all" else
+                                     arches.split(" "),
+                                     options))
+            self.categories[key] = sections
+
+        # (categories, version, arch) => list of rules, see rules()
+        self.cache = {}
+
+    def resolve_categories(self, names):
+        """ :param names: names from options="pmb:kconfigcheck-<NAME>" in the
+                          kernel APKBUILD, e.g. ["community", "uefi"]
+            :returns: tuple of sorted "category:…" keys, including the default
+                      category """
+        ret = {"category:default"}
+        for name in names:
+            if name in self.aliases:
+                ret.update(self.aliases[name])
+            else:
+                ret.add(f"category:{name}")
+
+        for category in ret:
+            if category not in self.categories:
+                raise RuntimeError(f"kconfigcheck.toml: unknown category:"
+                                   f" {category}")
+        return tuple(sorted(ret))
+
+    def rules(self, categories, version, arch):
+        """ Get all rules that apply to a kernel config.
+
+            :param categories: see resolve_categories()
+            :param version: kernel version (pkgver), e.g. "6.6.1"
+            :param arch: architecture of the config, e.g. "aarch64"
+            :returns: list of (category, option, expected value) """
+        key = (categories, version, arch)
+        if key in self.cache:
+            return self.cache[key]
+
+        ret = []
+        for category in categories:
+            for rules, arches, options in self.categories[category]:
+                if arches is not None and arch not in arches:
+                    continue
+                if not all(pmb.parse.version.check_string(version, rule)
+                           for rule in rules):
+                    continue
+                for option, expected in options.items():
+                    ret.append((category, option, expected))
+
+        self.cache[key] = ret
+        return ret
+
+    def check_config(self, config_path, arch, version, categories):
+        """ :param config_path: full path to the kernel config
+            :param arch: see rules()
+            :param version: see rules()
+            :param categories: see resolve_categories()
+            :returns: list of error strings """
+        config = parse_config(config_path)
+        config_name = os.path.basename(config_path)
+
+        ret = []
+        for category, option, expected in self.rules(categories, version,
+                                                     arch):
+            should = check_option(config, option, expected)
+            if should:
+                ret.append(f"{config_name}: CONFIG_{option} should {should}"
+                           f" ({category}):"
+                           f" https://wiki.postmarketos.org/wiki/kconfig#CONFIG_{option}")
+        return ret
+
+    def check_kernel(self, apkbuild_path, apkbuild):
+        """ Check all configs of a kernel package.
+
+            :param apkbuild_path: full path to the kernel APKBUILD
+            :param apkbuild: parsed APKBUILD
+            :returns: list of error strings, None if the kernel is skipped
+                      with options="!pmb:kconfigcheck" """
+        if "!pmb:kconfigcheck" in apkbuild["options"]:
+            return None
+
+        prefix = "pmb:kconfigcheck-"
+        names = [option[len(prefix):] for option in apkbuild["options"]
+                 if option.startswith(prefix)]
+        categories = self.resolve_categories(names)
+
+        ret = []
+        aport = os.path.dirname(apkbuild_path)
+        with instrumentation.measure("walk", "glob config-*"):
+            config_paths = sorted(glob.glob(f"{aport}/config-*"))
+        for config_path in config_paths:
+            config_name_split = os.path.basename(config_path).split(".")
+            if len(config_name_split) != 2:
+                ret.append(f"{config_path}: not a valid kernel config name,"
+                           " it must be config-<FLAVOR>.<ARCH>")
+                continue
+            ret += self.check_config(config_path, config_name_split[1],
+                                     apkbuild["pkgver"], categories)
+        return ret
+
+
+def check_kernels(pkgnames=None):
+    """ :param pkgnames: kernel packages to check, None for all linux-*
+                         packages
+        :returns: dict of pkgname => list of error strings, for the kernels
+                  that failed the check """
+    paths = common.get_apkbuild_paths()
+    if pkgnames is None:
+        pkgnames = sorted(p for p in paths if p.startswith("linux-"))
+
+    engine = KconfigCheck()
+    pmaports_dir = common.get_pmaports_dir()
+    ret = {}
+    for pkgname in pkgnames:
+        if pkgname not in paths:
+            ret[pkgname] = ["package not found"]
+            continue
+        apkbuild_path = f"{pmaports_dir}/{paths[pkgname]}"
+        with open(apkbuild_path, "rb") as handle:
+            apkbuild = apkbuild_index.parse_text(handle.read(), apkbuild_path)
+        errors = engine.check_kernel(apkbuild_path, apkbuild)
+        if errors:
+            ret[pkgname] = errors
+    return ret
+
+
+if __name__ == "__main__":
+    failed = check_kernels(sys.argv[1:] or None)
+    for pkgname, errors in failed.items():
+        print(f"{pkgname}:")
+        for error in errors:
+            print(f"  {error}")
+    if failed:
+        print(f"{len(failed)} kernel(s) failed the kconfig check")
+        sys.exit(1)
+    print("kconfig check succeeded!")
@@ -10,6 +10,7 @@ fi
 for log in \
 	/home/pmos/.local/var/pmbootstrap/log.txt \
 	/home/pmos/.local/var/pmbootstrap/log_testsuite_pmaports.txt \
+	/home/pmos/.local/var/pmbootstrap/ci_profile.json \
 	/home/pmos/.config/pmbootstrap.cfg \
 ; do
 	[ -e "$log" ] && mv "$log" "$1"
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Run independent checks in a process pool and collect their errors in a
+# deterministic order, so the output doesn't depend on the scheduling.
+
+import multiprocessing
+import os
+
+# Same dir
+import instrumentation
+
+# Arguments shared with the worker processes. They are inherited when
+# forking the workers, so they don't need to be pickled.
+context = ()
+
+
+def get_jobs(jobs=None):
+    """ :param jobs: amount of worker processes. None to read it from the
+                     PMAPORTS_CI_JOBS environment variable, which defaults
+                     to 1. 0 or "auto" means one worker per CPU core.
+        :returns: amount of worker processes as int """
+    if jobs is None:
+        jobs = os.environ.get("PMAPORTS_CI_JOBS") or 1
+    if jobs in [0, "0", "auto"]:
+        return os.cpu_count() or 1
+    return max(1, int(jobs))
+
+
+def _run_one(args):
+    func, item = args
+    return func(*context, item)
+
+
+def map_ordered(func, items, *func_context, jobs=None):
+    """ Call func(*func_context, item) for each item, in a pool of forked
+        worker processes if more than one job is used.
+
+        :param func: module level function (so it can be pickled)
+        :param items: list of picklable items
+        :param func_context: arguments passed to func before the item. They
+                             don't need to be picklable.
+        :param jobs: see get_jobs()
+        :returns: list of return values, in the same order as items """
+    global context
+
+    jobs = get_jobs(jobs)
+    items = list(items)
+    if jobs == 1 or len(items) < 2:
+        return [func(*func_context, item) for item in items]
+
+    context = func_context
+    try:
+        mp = multiprocessing.get_context("fork")
+        with mp.Pool(min(jobs, len(items))) as pool, \
+                instrumentation.measure("parallel", func.__name__,
+                                        len(items)):
+            chunksize = max(1, len(items) // (jobs * 8))
+            return pool.map(_run_one, [(func, item) for item in items],
+                            chunksize)
+    finally:
+        context = ()
+
+
+def run_checks(func, items, *func_context, jobs=None):
+    """ Run a check for each item and collect the errors.
+
+        :param func: module level function that gets called as
+                     func(*func_context, item) and returns a list of error
+                     strings (empty list if the check passed)
+        :param items: see map_ordered()
+        :param func_context: see map_ordered()
+        :param jobs: see get_jobs()
+        :returns: sorted list of all errors """
+    ret = []
+    for errors in map_ordered(func, items, *func_context, jobs=jobs):
+        ret += errors
+    return sorted(ret)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Persistent cache for parsed APKBUILDs etc. Results are stored in a sqlite
+# database and keyed by the paths and git blob hashes of the parsed files, so
+# unchanged files don't get parsed again in the next CI run.
+
+import json
+import os
+import sqlite3
+
+# Same dir
+import common
+
+# pmbootstrap
+import add_pmbootstrap_to_import_path  # noqa
+import pmb
+
+# Increase when changing the database layout or what gets stored in it
+schema_version = 2
+
+
+def get_blobs(paths=None):
+    """ Get the git blob hashes of files in the pmaports dir, as "git add"
+        would calculate them for the current content in the worktree.
+
+        :param paths: list of relative paths to limit the lookup to, or None
+                      to get the hashes of all files
+        :returns: {"main/hello-world/APKBUILD": "1c2f…", …} """
+    pathspec = ["--"] + list(paths) if paths else []
+
+    # Hashes of files in the git index
+    ret = {}
+    for entry in common.run_git(["ls-files", "-s", "-z"] +
+                                pathspec).split("\0"):
+        if entry:
+            info, path = entry.split("\t", 1)
+            ret[path] = info.split(" ")[1]
+
+    # Files that are modified in the worktree or not tracked: hash what is
+    # actually on disk
+    dirty = common.run_git(["ls-files", "-m", "-o", "--exclude-standard",
+                            "-z"] + pathspec).split("\0")
+    pmaports_dir = common.get_pmaports_dir()
+    dirty = [path for path in set(dirty)
+             if os.path.isfile(f"{pmaports_dir}/{path}")]
+    for path in dirty:
+        ret.pop(path, None)
+    if dirty:
+        blobs = common.run_git(["hash-object", "--"] + dirty).splitlines()
+        ret.update(zip(dirty, blobs))
+
+    return ret
+
+
+class ParseCache:
+    """ Cache parse results in a sqlite database. The database gets reset
+        when the pmbootstrap version changes, because the parse results may
+        look different with another version. """
+
+    def __init__(self, path):
+        """ :param path: to the sqlite database, gets created if missing """
+        self.path = path
+        self.blobs = get_blobs()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.pid = None
+        self.db = None
+        db = self.connection()
+        db.execute("CREATE TABLE IF NOT EXISTS meta"
+                   " (key TEXT PRIMARY KEY, value TEXT)")
+        version = f"{schema_version}/{pmb.__version__}"
+        row = db.execute("SELECT value FROM meta WHERE key = 'version'"
+                         ).fetchone()
+        if not row or row[0] != version:
+            db.execute("DROP TABLE IF EXISTS parsed")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                       (version,))
+        db.execute("CREATE TABLE IF NOT EXISTS parsed"
+                   " (kind TEXT, key TEXT, data TEXT,"
+                   " PRIMARY KEY (kind, key))")
+
+    def connection(self):
+        """ :returns: database connection for the current process. Forked
+                      worker processes (see parallel.py) must not share the
+                      connection of the parent, so they open their own one.
+                      Each write gets committed right away, so no process
+                      holds the write lock for longer than necessary and the
+                      workers don't need to be closed explicitly. """
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.db = sqlite3.connect(self.path, timeout=60,
+                                      isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+        return self.db
+
+    def key(self, paths):
+        """ :param paths: relative paths of the files the parse result
+                          depends on
+            :returns: cache key, or None if a file is not in the git index
+                      and not on disk (so it can't be cached). It includes
+                      the paths, as parsing also checks them (e.g. the
+                      pkgname must be the name of the APKBUILD's dir), so a
+                      copy of a file in another dir must not get the parse
+                      result of the original. """
+        ret = []
+        for path in paths:
+            if path not in self.blobs:
+                return None
+            ret.append(f"{path}:{self.blobs[path]}")
+        return ",".join(ret)
+
+    def lookup(self, kind, key):
+        """ :param kind: what was parsed, e.g. "apkbuild"
+            :param key: return value of key()
+            :returns: the stored parse result or None """
+        if key is None:
+            return None
+        row = self.connection().execute("SELECT data FROM parsed WHERE"
+                                        " kind = ? AND key = ?",
+                                        (kind, key)).fetchone()
+        if not row:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def store(self, kind, key, data):
+        """ :param data: parse result, must be serializable as JSON """
+        if key is None:
+            return
+        self.connection().execute("INSERT OR REPLACE INTO parsed VALUES"
+                                  " (?, ?, ?)", (kind, key, json.dumps(data)))
+
+    def get(self, kind, paths, parse):
+        """ Get a parse result from the cache, or parse and store it.
+
+            :param kind: what gets parsed, e.g. "apkbuild"
+            :param paths: relative paths of all files that the parse result
+                          depends on (first one is the parsed file)
+            :param parse: function without arguments that does the actual
+                          parsing. It must return something that can be
+                          stored as JSON.
+            :returns: the parse result """
+        key = self.key(paths)
+        ret = self.lookup(kind, key)
+        if ret is None:
+            ret = parse()
+            self.store(kind, key, ret)
+        return ret
+
+    def close(self):
+        self.connection().close()
+        print(f"parse cache: {self.hits} hits, {self.misses} misses"
+              f" ({self.path})")
+
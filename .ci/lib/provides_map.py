@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Check that the dependencies of packages can be installed, for each arch the
+# packages claim to support. Instead of looking up each dependency with
+# pmb.helpers.package.get(), one map of installable names (pkgnames,
+# subpackages and provides) gets built per arch from the parsed pmaports
+# tree and the APKINDEX files that pmbootstrap has downloaded. Checking a
+# dependency is a dict lookup then, so the whole tree can be checked.
+#
+# Like pmb.helpers.package.get(), pmaports takes precedence: a name that
+# pmaports provides, but not for the arch, only resolves through a binary
+# package built for the arch. A noarch binary package doesn't count, as
+# pmb.helpers.package.check_arch() looks at the arch of the pmaport then.
+#
+# Two kinds of names resolve without being in the map: subpackages that the
+# APKBUILD parser can't see (see apkbuild_index.hidden_subpackages) and
+# makedepends on packages in cross/, as pmbootstrap installs those in the
+# native chroot no matter which arch gets built.
+
+# Same dir
+import apkbuild_index
+
+# pmbootstrap
+import add_pmbootstrap_to_import_path  # noqa
+import pmb.helpers.pmaports
+import pmb.helpers.repo
+import pmb.parse.apkindex
+
+# References that must be installable on the arch of the package. Each
+# subpackage gets checked too, with the keys it supports.
+kinds_package = ["depends", "makedepends", "_pmb_recommends"]
+kinds_subpackage = ["depends", "_pmb_recommends"]
+
+
+class ProvidesMap:
+    """ Names that can be installed on one arch, with their providers. """
+
+    def __init__(self, arch):
+        self.arch = arch
+
+        # Name => set of providers: relative package dirs for pmaports,
+        # "apkindex:<pkgname>" for binary packages
+        self.providers = {}
+
+        # Names that pmaports provides only for other arches, see
+        # add_apkindex()
+        self.other_arches = set()
+
+        # Name => set of package dirs in cross/, for makedepends
+        self.cross = {}
+
+    def add(self, name, provider):
+        self.providers.setdefault(name, set()).add(provider)
+
+    def add_pmaports(self, apkbuilds):
+        """ :param apkbuilds: dict of relative package dir => parsed APKBUILD
+                              (see apkbuild_index.ApkbuildIndex.get_all()).
+                              Packages that can't be built for the arch only
+                              block their names from the APKINDEX. """
+        other_arches = set()
+        for package_dir, apkbuild in apkbuilds.items():
+            names = [apkbuild["pkgname"]] + list(apkbuild["subpackages"])
+            provides = list(apkbuild["provides"])
+            for subpackage in apkbuild["subpackages"].values():
+                provides += (subpackage or {}).get("provides", [])
+
+            # Like pmb.helpers.pmaports.find(), only provides with a version
+            # make pmaports take precedence
+            blocking = names + [apkbuild_index.get_depend_name(provide)
+                                for provide in provides if "=" in provide]
+            names += [apkbuild_index.get_depend_name(provide)
+                      for provide in provides]
+
+            if package_dir.startswith("cross/"):
+                for name in names:
+                    self.cross.setdefault(name, set()).add(package_dir)
+            if not pmb.helpers.pmaports.check_arches(apkbuild["arch"],
+                                                     self.arch):
+                other_arches.update(blocking)
+                continue
+            for name in names:
+                self.add(name, package_dir)
+        self.other_arches |= other_arches - set(self.providers)
+
+    def add_apkindex(self, blocks):
+        """ Add binary packages, after add_pmaports().
+
+            :param blocks: parsed blocks of the APKINDEX files of the arch,
+                           see pmb.parse.apkindex.parse_blocks() """
+        for block in blocks:
+            provider = f"apkindex:{block['pkgname']}"
+            for name in [block["pkgname"]] + block["provides"]:
+                if name not in self.other_arches or \
+                        block["arch"] == self.arch:
+                    self.add(name, provider)
+
+    def resolve(self, name, kind=None):
+        """ :param name: dependency, e.g. "hello-world>=1.0"
+            :param kind: where the name is from, e.g. "makedepends"
+            :returns: set of providers, empty if it can't be installed """
+        name = apkbuild_index.get_depend_name(name)
+        if name in self.providers:
+            return self.providers[name]
+        if kind == "makedepends" and name in self.cross:
+            return self.cross[name]
+        parent = apkbuild_index.get_hidden_subpackage_parent(name)
+        return self.providers.get(parent, set())
+
+
+def load_apkindex(args, arch):
+    """ Update the APKINDEX files of an arch (if they are outdated) and parse
+        them.
+
+        :returns: list of parsed blocks of all binary repositories """
+    pmb.helpers.repo.update(args, arch)
+    ret = []
+    for path in pmb.helpers.repo.apkindex_files(args, arch,
+                                                user_repository=False):
+        ret += pmb.parse.apkindex.parse_blocks(path)
+    return ret
+
+
+def build(args, apkbuilds, arches):
+    """ :param apkbuilds: see ProvidesMap.add_pmaports()
+        :param arches: list of architectures, e.g. ["x86_64", "aarch64"]
+        :returns: dict of arch => ProvidesMap """
+    ret = {}
+    for arch in arches:
+        provides = ProvidesMap(arch)
+        provides.add_pmaports(apkbuilds)
+        provides.add_apkindex(load_apkindex(args, arch))
+        ret[arch] = provides
+    return ret
+
+
+def get_references(apkbuild):
+    """ :param apkbuild: parsed APKBUILD
+        :returns: list of (subpkgname or None, kind, name) of the references
+                  that must be installable, without conflicts ("!foo") """
+    packages = [(None, apkbuild, kinds_package)]
+    packages += [(subpkgname, subpackage, kinds_subpackage)
+                 for subpkgname, subpackage in apkbuild["subpackages"].items()
+                 if subpackage]
+    ret = []
+    for subpkgname, package, kinds in packages:
+        for kind in kinds:
+            for name in package.get(kind, []):
+                if not name.startswith("!"):
+                    ret.append((subpkgname, kind, name))
+    return ret
+
+
+def find_unresolvable(apkbuild, maps, kinds=None):
+    """ :param apkbuild: parsed APKBUILD
+        :param maps: see build()
+        :param kinds: only check these references, e.g. ["_pmb_recommends"].
+                      None for all of kinds_package and kinds_subpackage.
+        :returns: list of (arch, subpkgname or None, kind, name) for each
+                  reference that can't be installed on an arch the package
+                  supports """
+    references = [reference for reference in get_references(apkbuild)
+                  if kinds is None or reference[1] in kinds]
+    ret = []
+    for arch, provides in sorted(maps.items()):
+        if not pmb.helpers.pmaports.check_arches(apkbuild["arch"], arch):
+            continue
+        for subpkgname, kind, name in references:
+            if not provides.resolve(name, kind):
+                ret.append((arch, subpkgname, kind, name))
+    return ret
+
+
+def format_error(path, arch, subpkgname, kind, name):
+    """ :param path: to the APKBUILD
+        :returns: error string for an entry of find_unresolvable() """
+    where = f" of subpackage {subpkgname}" if subpkgname else ""
+    return (f"{path}: package '{name}' from {kind}{where} not found for arch"
+            f" '{arch}'")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Reverse dependencies of all packages in pmaports, to find out which other
+# packages are affected by a change: device packages depending on a changed
+# soc-* or firmware package, UIs listing a changed app in _pmb_recommends,
+# packages using a changed library in makedepends etc.
+#
+# Add [ci:build-revdeps] to the commit message to also build the packages
+# that directly depend on the changed ones.
+#
+# revdep_index.py [--depth N] [PKGNAME...]
+#   Print the packages affected by changing the given packages, or by the
+#   packages changed in this branch if none are given.
+
+import argparse
+import os
+
+# Same dir
+import apkbuild_index
+import common
+
+# Kinds of references between packages. Subpackages count as part of the
+# package that defines them.
+kinds_all = ["depends", "makedepends", "_pmb_recommends"]
+
+# The references that make a package fail to build if the other one breaks
+kinds_build = ["depends", "makedepends"]
+
+
+def parse_tree():
+    """ Parse all APKBUILDs in memory, without pmbootstrap's APKBUILD cache.
+
+        :returns: dict of relative package dir => parsed APKBUILD, without
+                  the ones that fail to parse (they get printed) """
+    pmaports_dir = common.get_pmaports_dir()
+    ret = {}
+    for path in common.get_apkbuild_paths().values():
+        full_path = f"{pmaports_dir}/{path}"
+        with open(full_path, "rb") as handle:
+            content = handle.read()
+        try:
+            ret[os.path.dirname(path)] = apkbuild_index.parse_text(content,
+                                                                   full_path)
+        except (RuntimeError, ValueError) as e:
+            print(f"WARNING: failed to parse {path}, its reverse dependencies"
+                  f" are missing: {e}")
+    return ret
+
+
+def get_references(apkbuild):
+    """ :param apkbuild: parsed APKBUILD
+        :returns: list of (kind, name), e.g. ("depends", "mesa") """
+    ret = []
+    packages = [apkbuild] + [subpackage for subpackage
+                             in apkbuild["subpackages"].values() if subpackage]
+    for package in packages:
+        for kind in kinds_all:
+            for depend in package.get(kind, []):
+                if depend.startswith("!"):
+                    continue
+                ret.append((kind, apkbuild_index.get_depend_name(depend)))
+    return ret
+
+
+class ReverseDependencyIndex:
+    """ Which packages reference which, in both directions. """
+
+    def __init__(self, apkbuilds):
+        """ :param apkbuilds: dict of relative package dir => parsed APKBUILD,
+                              see parse_tree() """
+        # Pkgname => package dir
+        self.package_dirs_by_pkgname = {}
+
+        # Name (pkgname, subpackage or provides) => set of package dirs.
+        # Virtual names can be provided by multiple packages.
+        self.providers = {}
+        for package_dir, apkbuild in apkbuilds.items():
+            self.package_dirs_by_pkgname[apkbuild["pkgname"]] = package_dir
+            names = [apkbuild["pkgname"]] + list(apkbuild["subpackages"])
+            names += [apkbuild_index.get_depend_name(provide)
+                      for provide in apkbuild["provides"]]
+            for name in names:
+                self.providers.setdefault(name, set()).add(package_dir)
+
+        # Package dir => kind => set of package dirs referencing it
+        self.users = {}
+        for package_dir, apkbuild in apkbuilds.items():
+            for kind, name in get_references(apkbuild):
+                for provider in self.get_providers(name):
+                    if provider != package_dir:
+                        kinds = self.users.setdefault(provider, {})
+                        kinds.setdefault(kind, set()).add(package_dir)
+
+    def get_providers(self, name):
+        """ :param name: name from depends etc., e.g. "firmware-qcom-adreno-a300"
+            :returns: set of package dirs providing it. If no package does,
+                      the package from apkbuild_index.hidden_subpackages the
+                      name belongs to. Empty set for names from outside of
+                      pmaports. """
+        if name in self.providers:
+            return self.providers[name]
+        parent = apkbuild_index.get_hidden_subpackage_parent(name)
+        if parent in self.package_dirs_by_pkgname:
+            return {self.package_dirs_by_pkgname[parent]}
+        return set()
+
+    def get_package_dirs(self, pkgnames):
+        """ :param pkgnames: names of packages in pmaports
+            :returns: list of their relative package dirs (unknown pkgnames
+                      are skipped, e.g. deleted packages) """
+        return [self.package_dirs_by_pkgname[pkgname] for pkgname in pkgnames
+                if pkgname in self.package_dirs_by_pkgname]
+
+    def get_direct(self, package_dirs, kinds=kinds_all):
+        """ :param package_dirs: relative package dirs
+            :param kinds: references to follow, see kinds_all
+            :returns: set of package dirs that directly reference any of the
+                      given packages (without the given packages) """
+        ret = set()
+        for package_dir in package_dirs:
+            users = self.users.get(package_dir, {})
+            for kind in kinds:
+                ret |= users.get(kind, set())
+        return ret - set(package_dirs)
+
+    def affected(self, package_dirs, depth=None, kinds=kinds_all):
+        """ Find all packages affected by changing the given packages.
+
+            :param package_dirs: relative package dirs of the change set
+            :param depth: maximum amount of references to follow, None for
+                          the transitive closure
+            :param kinds: see get_direct()
+            :returns: dict of affected package dir => distance to the change
+                      set (not including the given packages) """
+        ret = {}
+        seen = set(package_dirs)
+        current = set(package_dirs)
+        distance = 0
+        while current and (depth is None or distance < depth):
+            distance += 1
+            current = self.get_direct(current, kinds) - seen
+            seen |= current
+            for package_dir in current:
+                ret[package_dir] = distance
+        return ret
+
+
+def add_reverse_dependencies(packages):
+    """ Add packages that need to be rebuilt with the given ones, for
+        [ci:build-revdeps].
+
+        :param packages: pkgnames of changed packages
+        :returns: sorted list of the pkgnames plus the pkgnames of packages
+                  that directly depend on them (depends or makedepends) """
+    apkbuilds = parse_tree()
+    index = ReverseDependencyIndex(apkbuilds)
+    package_dirs = index.get_package_dirs(packages)
+    affected = index.get_direct(package_dirs, kinds_build)
+    return sorted(set(packages) |
+                  {apkbuilds[package_dir]["pkgname"]
+                   for package_dir in affected})
+
+
+def get_packages_to_build(packages):
+    """ :param packages: pkgnames of changed packages
+        :returns: sorted list of the packages, plus their reverse
+                  dependencies if the last commit has [ci:build-revdeps] """
+    if not common.commit_message_has_string("[ci:build-revdeps]"):
+        return sorted(packages)
+    ret = add_reverse_dependencies(packages)
+    added = sorted(set(ret) - set(packages))
+    print("building reverse dependencies too ([ci:build-revdeps]): " +
+          (", ".join(added) or "(none)"))
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=None,
+                        help="maximum amount of references to follow"
+                        " (default: all)")
+    parser.add_argument("pkgnames", nargs="*")
+    args = parser.parse_args()
+
+    pkgnames = args.pkgnames
+    if not pkgnames:
+        common.add_upstream_git_remote()
+        pkgnames = sorted(common.get_changed_packages())
+
+    index = ReverseDependencyIndex(parse_tree())
+    package_dirs = index.get_package_dirs(pkgnames)
+    affected = index.affected(package_dirs, args.depth)
+    print(f"changed: {', '.join(package_dirs)}")
+    for package_dir, distance in sorted(affected.items(),
+                                        key=lambda item: (item[1], item[0])):
+        print(f"{distance}: {package_dir}")
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Run many checks on the packages of pmaports in one traversal. Checks
+# register as rules with the @rule() decorator, either for each package, for
+# each subpackage or for each file of a package, with filters for the
+# category (e.g. "device/*") and the pkgname prefix (e.g. "linux-"). run()
+# then parses each package once and passes it to all rules that match it, so
+# adding a rule doesn't cost another pass over the tree.
+#
+# The testcases register their rules when pytest imports them, the
+# "lint_results" fixture in conftest.py runs them and the tests report the
+# results of their rules.
+
+import fnmatch
+import os
+
+# Same dir
+import parallel
+
+# Rules registered with @rule()
+rules = []
+
+
+def match_category(category, patterns):
+    """ :param category: dir of a package, e.g. "device/community"
+        :param patterns: list of fnmatch patterns, "*" doesn't match "/"
+        :returns: True if any of the patterns matches """
+    segments = category.split("/")
+    for pattern in patterns:
+        pattern_segments = pattern.split("/")
+        if len(pattern_segments) == len(segments) and \
+                all(fnmatch.fnmatchcase(segment, pattern_segment)
+                    for segment, pattern_segment
+                    in zip(segments, pattern_segments)):
+            return True
+    return False
+
+
+class Rule:
+    """ A check that gets called for matching packages, subpackages or
+        files. """
+
+    def __init__(self, func, kind, categories=None, exclude=None,
+                 prefix=None, restricted=True):
+        """ :param func: called as func(context, package) for kind
+                         "package", func(context, package, subpkgname,
+                         subpackage) for "subpackage" (only subpackages with
+                         their own packaging function) and
+                         func(context, package, file) for "file" (see
+                         tree_inventory.File, hidden files are skipped). It
+                         returns a list of results, usually error strings.
+                         Raising a RuntimeError adds its message as result.
+            :param kind: "package", "subpackage" or "file"
+            :param categories: fnmatch patterns of categories to check, e.g.
+                               ["device/*"]. None for all categories.
+            :param exclude: fnmatch patterns of categories to skip
+            :param prefix: only check packages whose dir name starts with it
+            :param restricted: only check the packages selected in
+                               incremental mode (see
+                               ApkbuildIndex.restrict()) """
+        if kind not in ["package", "subpackage", "file"]:
+            raise ValueError(f"invalid kind of rule: {kind}")
+        self.func = func
+        self.name = func.__name__
+        self.kind = kind
+        self.categories = categories
+        self.exclude = exclude
+        self.prefix = prefix
+        self.restricted = restricted
+
+    def applies(self, apkbuilds, package_dir):
+        """ :param apkbuilds: apkbuild_index.ApkbuildIndex instance
+            :param package_dir: relative package dir, e.g. "main/hello-world"
+            :returns: True if the rule needs to check the package """
+        if self.restricted and apkbuilds.restricted is not None and \
+                package_dir not in apkbuilds.restricted:
+            return False
+        category, pkgname = os.path.split(package_dir)
+        if self.prefix and not pkgname.startswith(self.prefix):
+            return False
+        if self.categories is not None and \
+                not match_category(category, self.categories):
+            return False
+        if self.exclude and match_category(category, self.exclude):
+            return False
+        return True
+
+
+def rule(kind, categories=None, exclude=None, prefix=None, restricted=True):
+    """ Decorator to register a function as rule, see Rule for the
+        parameters. The name of the function is the name of the rule. """
+    def register(func):
+        if any(existing.name == func.__name__ for existing in rules):
+            raise RuntimeError(f"rule registered twice: {func.__name__}")
+        rules.append(Rule(func, kind, categories, exclude, prefix,
+                          restricted))
+        return func
+    return register
+
+
+class Context:
+    """ What the rules get to look at, besides the current package. """
+
+    def __init__(self, args, apkbuilds, inventory):
+        """ :param args: pmbootstrap args
+            :param apkbuilds: apkbuild_index.ApkbuildIndex instance
+            :param inventory: tree_inventory.Inventory instance """
+        self.args = args
+        self.apkbuilds = apkbuilds
+        self.inventory = inventory
+
+
+class Package:
+    """ The package that the rules are currently looking at. """
+
+    def __init__(self, context, package_dir):
+        self.package_dir = package_dir
+        self.category, self.name = os.path.split(package_dir)
+        self.path = context.apkbuilds.path(package_dir)
+        self.apkbuild = context.apkbuilds.get(package_dir)
+
+        # Values derived from the package that multiple rules need, e.g. the
+        # parsed checksums. Rules store them here, so they are only
+        # calculated once per package.
+        self.memo = {}
+
+    def read_text(self):
+        """ :returns: content of the APKBUILD """
+        if "text" not in self.memo:
+            with open(self.path, encoding="utf-8") as handle:
+                self.memo["text"] = handle.read()
+        return self.memo["text"]
+
+
+def call(rule, *func_args):
+    """ :returns: results of the rule, see Rule """
+    try:
+        return rule.func(*func_args)
+    except RuntimeError as e:
+        return [str(e)]
+
+
+def visit(context, rules, package_dir):
+    """ Run all rules that apply to one package.
+
+        :returns: dict of rule name => list of results """
+    package = Package(context, package_dir)
+    ret = {}
+    for current in rules:
+        if not current.applies(context.apkbuilds, package_dir):
+            continue
+
+        results = []
+        if current.kind == "package":
+            results += call(current, context, package)
+        elif current.kind == "subpackage":
+            subpackages = package.apkbuild["subpackages"]
+            for subpkgname, subpackage in subpackages.items():
+                if subpackage:
+                    results += call(current, context, package, subpkgname,
+                                    subpackage)
+        else:
+            for file in context.inventory.package_files(package_dir):
+                results += call(current, context, package, file)
+        ret[current.name] = results
+    return ret
+
+
+class Results:
+    """ Results of all rules after run(). """
+
+    def __init__(self, rules):
+        # Rule name => list of results, in the order of the packages
+        self.results = {current.name: [] for current in rules}
+
+    def get(self, name):
+        """ :param name: name of the rule (its function name)
+            :returns: list of results """
+        if name not in self.results:
+            raise RuntimeError(f"rule did not run: {name}")
+        return self.results[name]
+
+    def report(self, *names, log=print):
+        """ Print the errors of rules and raise an error if there are any.
+
+            :param names: names of rules that return error strings
+            :param log: function to print one error """
+        errors = []
+        for name in names:
+            errors += self.get(name)
+        if not errors:
+            return
+        for error in errors:
+            log(error)
+        raise RuntimeError(f"{', '.join(names)} failed with {len(errors)}"
+                           " errors")
+
+
+def run(context, jobs=None, rules=rules):
+    """ Traverse all packages once and run the rules on them.
+
+        :param context: Context instance
+        :param jobs: see parallel.get_jobs()
+        :returns: Results instance """
+    apkbuilds = context.apkbuilds
+    package_dirs = [package_dir for package_dir
+                    in apkbuilds.select(restricted=False)
+                    if any(current.applies(apkbuilds, package_dir)
+                           for current in rules)]
+    ret = Results(rules)
+    for results in parallel.map_ordered(visit, package_dirs, context, rules,
+                                        jobs=jobs):
+        for name, found in results.items():
+            ret.results[name] += found
+    return ret
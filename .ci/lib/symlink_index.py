@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Reverse index of the symlinks in pmaports: which symlinks point to a file
+# (or to one of its parent dirs). Files in device/.shared-patches are not
+# part of any package, but kernel and u-boot packages link to them, so a
+# change of a shared patch affects all packages with such a symlink. See
+# common.get_symlink_index().
+
+import os
+
+
+class SymlinkIndex:
+    """ All symlinks of the pmaports git repository, by target. """
+
+    def __init__(self, pmaports_dir, links):
+        """ :param pmaports_dir: full path to the pmaports dir
+            :param links: relative paths of all symlinks """
+        # Target (relative path, normalized) => set of symlinks pointing to it
+        self.links_by_target = {}
+        for link in links:
+            try:
+                target = os.readlink(f"{pmaports_dir}/{link}")
+            except OSError:
+                # Deleted in the worktree, but not in the git index
+                continue
+            target = os.path.normpath(os.path.join(os.path.dirname(link),
+                                                   target))
+            self.links_by_target.setdefault(target, set()).add(link)
+
+    def get_links(self, path):
+        """ :param path: relative path of a file, e.g.
+                         "device/.shared-patches/linux/gcc8-fix-put-user.patch"
+            :returns: set of symlinks that resolve to the file, directly,
+                      through a symlink to one of its parent dirs or through
+                      other symlinks """
+        ret = set()
+        todo = [path]
+        while todo:
+            current = todo.pop()
+            segments = current.split("/")
+            for i in range(len(segments), 0, -1):
+                target = "/".join(segments[:i])
+                rest = segments[i:]
+                for link in self.links_by_target.get(target, []):
+                    link = "/".join([link] + rest)
+                    if link not in ret:
+                        ret.add(link)
+                        todo.append(link)
+        return ret
+
+    def get_links_many(self, paths):
+        """ :param paths: relative paths of files
+            :returns: dict of path => set of symlinks, see get_links(). Paths
+                      without symlinks are not included. """
+        ret = {}
+        for path in paths:
+            links = self.get_links(path)
+            if links:
+                ret[path] = links
+        return ret
+
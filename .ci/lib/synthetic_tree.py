@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Generate a synthetic pmaports tree of configurable size, to measure how the
+# CI scripts scale (see benchmark.py). The tree has generic packages with
+# dependencies between them, device packages with deviceinfo files, kernels
+# with config files and symlinks to patches in device/.shared-patches, and
+# CODEOWNERS entries for the devices.
+#
+# The tree is a git repository with a copy of this .ci dir, so the scripts in
+# it work on the synthetic tree. Its "upstream" remote is a bare repository
+# with the master branch, the checked out branch has one more commit that
+# changes some packages and a shared patch, like a merge request would.
+#
+# synthetic_tree.py [--packages N] [--devices N] ... OUTPUT_DIR
+#   Generate the tree in OUTPUT_DIR, which must not exist yet.
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import subprocess
+
+# Same dir
+import common
+
+# Distfile of all kernels, the checksum doesn't matter as it never gets
+# downloaded (but it must be the same everywhere, see test_distfiles_conflict)
+kernel_distfile = "linux-6.6.tar.xz"
+kernel_distfile_checksum = hashlib.sha512(kernel_distfile.encode()).hexdigest()
+
+# Share of devices in each category
+device_categories = {
+    "device/main": 0.05,
+    "device/community": 0.15,
+    "device/testing": 0.8,
+}
+
+# Maintainers of device/main and device/community packages
+maintainers = ["@synthetic-a", "@synthetic-b"]
+
+apkbuild_generic = """\
+# Maintainer: Synthetic A <a@example.org>
+pkgname={pkgname}
+pkgver=1.{number}
+pkgrel={pkgrel}
+pkgdesc="Synthetic package {number}"
+url="https://postmarketos.org"
+arch="{arch}"
+license="MIT"
+depends="{depends}"
+makedepends="{makedepends}"
+subpackages="$pkgname-doc"
+source="{pkgname}.conf"
+options="!check"
+
+package() {{
+	install -Dm644 "$srcdir"/{pkgname}.conf \\
+		"$pkgdir"/etc/{pkgname}.conf
+}}
+
+sha512sums="
+{sha512sums}
+"
+"""
+
+apkbuild_device = """\
+# Reference: <https://postmarketos.org/devicepkg>
+# Maintainer: Synthetic A <a@example.org>
+# Co-Maintainer: Synthetic B <b@example.org>
+pkgname=device-{codename}
+pkgdesc="{name}"
+pkgver=1
+pkgrel=0
+url="https://postmarketos.org"
+license="MIT"
+arch="{arch}"
+options="!check !archcheck"
+depends="postmarketos-base linux-{codename}"
+makedepends="devicepkg-dev"
+source="deviceinfo"
+
+build() {{
+	devicepkg_build $startdir $pkgname
+}}
+
+package() {{
+	devicepkg_package $startdir $pkgname
+}}
+
+sha512sums="
+{sha512sums}
+"
+"""
+
+deviceinfo = """\
+# Reference: <https://postmarketos.org/deviceinfo>
+# Please use double quotes only. You can source this file in shell scripts.
+
+deviceinfo_format_version="0"
+deviceinfo_name="{name}"
+deviceinfo_manufacturer="Synthetic"
+deviceinfo_codename="{codename}"
+deviceinfo_year="2024"
+deviceinfo_dtb="synthetic/{codename}"
+deviceinfo_arch="{arch}"
+
+# Device related
+deviceinfo_chassis="handset"
+deviceinfo_keyboard="false"
+deviceinfo_external_storage="true"
+deviceinfo_screen_width="720"
+deviceinfo_screen_height="1440"
+
+# Bootloader related
+deviceinfo_flash_method="fastboot"
+deviceinfo_generate_bootimg="true"
+deviceinfo_flash_offset_base="0x80000000"
+"""
+
+apkbuild_kernel = """\
+# Maintainer: Synthetic A <a@example.org>
+# Co-Maintainer: Synthetic B <b@example.org>
+pkgname=linux-{codename}
+pkgver=6.6.0
+pkgrel=0
+pkgdesc="{name} kernel"
+arch="{arch}"
+_carch="{carch}"
+_flavor="{codename}"
+url="https://kernel.org"
+license="GPL-2.0-only"
+options="!strip !check !tracedeps pmb:cross-native pmb:kconfigcheck-community"
+makedepends="bash bc bison devicepkg-dev findutils flex openssl-dev perl"
+
+_config="config-$_flavor.$arch"
+source="
+	https://cdn.kernel.org/pub/linux/kernel/v6.x/{distfile}
+	$_config
+{patches}"
+builddir="$srcdir/linux-6.6"
+
+prepare() {{
+	default_prepare
+	cp "$srcdir"/$_config .config
+}}
+
+build() {{
+	unset LDFLAGS
+	make ARCH="$_carch" CC="${{CC:-gcc}}"
+}}
+
+package() {{
+	downstreamkernel_package "$builddir" "$pkgdir" "$_carch" \\
+		"$_flavor" "$_outdir"
+}}
+
+sha512sums="
+{sha512sums}
+"
+"""
+
+device_arches = {"aarch64": "arm64", "armv7": "arm"}
+
+
+def sha512(data):
+    return hashlib.sha512(data.encode()).hexdigest()
+
+
+def write(path, content, mode=0o644):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as handle:
+        handle.write(content)
+    os.chmod(path, mode)
+
+
+def format_checksums(files):
+    """ :param files: list of (filename, content)
+        :returns: lines for sha512sums= """
+    return "\n".join(f"{sha512(content)}  {filename}"
+                     for filename, content in files)
+
+
+def run_git(path, parameters):
+    subprocess.run(["git", "-C", path] + parameters, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+class Generator:
+    """ Writes the files of one synthetic tree. """
+
+    def __init__(self, path, packages, devices, shared_patches, links,
+                 seed=0):
+        """ :param path: output dir
+            :param packages: total amount of APKBUILDs (including device
+                             packages and kernels)
+            :param devices: amount of devices, each one has a device package
+                            and a kernel
+            :param shared_patches: amount of patches in
+                                   device/.shared-patches/linux
+            :param links: amount of shared patches each kernel links to
+            :param seed: for the random dependencies """
+        self.path = path
+        self.generic = max(1, packages - 2 * devices - 1)
+        self.devices = devices
+        self.shared_patches = shared_patches
+        self.links = min(links, shared_patches)
+        self.random = random.Random(seed)
+
+        # Relative dirs of the device packages and kernels in device/main and
+        # device/community, for CODEOWNERS
+        self.maintained = []
+
+    def generic_package(self, number, pkgrel=0):
+        pkgname = f"synthetic-{number}"
+        conf = f"# {pkgname}\nkey=value{number}\n"
+        depends = []
+        makedepends = []
+        if number > 1:
+            depends = [f"synthetic-{self.random.randint(1, number - 1)}"
+                       for _ in range(self.random.randint(0, 3))]
+            makedepends = [f"synthetic-{self.random.randint(1, number - 1)}"
+                           for _ in range(self.random.randint(0, 2))]
+        package_dir = f"{self.path}/main/{pkgname}"
+        write(f"{package_dir}/{pkgname}.conf", conf)
+        write(f"{package_dir}/APKBUILD", apkbuild_generic.format(
+            pkgname=pkgname, number=number, pkgrel=pkgrel,
+            arch="noarch" if number % 3 else "all",
+            depends=" ".join(sorted(set(depends))),
+            makedepends=" ".join(sorted(set(makedepends))),
+            sha512sums=format_checksums([(f"{pkgname}.conf", conf)])))
+
+    def postmarketos_base(self):
+        package_dir = f"{self.path}/main/postmarketos-base"
+        conf = "# postmarketos-base\n"
+        write(f"{package_dir}/postmarketos-base.conf", conf)
+        write(f"{package_dir}/APKBUILD", apkbuild_generic.format(
+            pkgname="postmarketos-base", number=0, pkgrel=0, arch="noarch",
+            depends="", makedepends="",
+            sha512sums=format_checksums([("postmarketos-base.conf", conf)])))
+
+    def shared_patch(self, number):
+        return (f"From: Synthetic <a@example.org>\n"
+                f"Subject: synthetic patch {number}\n\n"
+                f"--- a/Makefile\n+++ b/Makefile\n@@ -1 +1 @@\n"
+                f"-EXTRAVERSION =\n+EXTRAVERSION = -synthetic{number}\n")
+
+    def device(self, number, category):
+        codename = f"synthetic-dev{number}"
+        name = f"Synthetic Device {number}"
+        arch = list(device_arches)[number % len(device_arches)]
+
+        # Device package
+        device_dir = f"{category}/device-{codename}"
+        info = deviceinfo.format(name=name, codename=codename, arch=arch)
+        write(f"{self.path}/{device_dir}/deviceinfo", info)
+        write(f"{self.path}/{device_dir}/APKBUILD", apkbuild_device.format(
+            codename=codename, name=name, arch=arch,
+            sha512sums=format_checksums([("deviceinfo", info)])))
+
+        # Kernel with config and symlinks to shared patches
+        kernel_dir = f"{category}/linux-{codename}"
+        config = f"config-{codename}.{arch}"
+        config_content = "".join(f"CONFIG_SYNTHETIC_{i}=y\n"
+                                 for i in range(number % 50 + 50))
+        write(f"{self.path}/{kernel_dir}/{config}", config_content)
+
+        files = [(config, config_content)]
+        patches = ""
+        for i in self.random.sample(range(self.shared_patches), self.links):
+            filename = f"{i:04}-synthetic.patch"
+            os.symlink(f"../../.shared-patches/linux/{filename}",
+                       f"{self.path}/{kernel_dir}/{filename}")
+            files.append((filename, self.shared_patch(i)))
+            patches += f"\t{filename}\n"
+
+        checksums = f"{kernel_distfile_checksum}  {kernel_distfile}\n"
+        checksums += format_checksums(files)
+        write(f"{self.path}/{kernel_dir}/APKBUILD", apkbuild_kernel.format(
+            codename=codename, name=name, arch=arch,
+            carch=device_arches[arch], distfile=kernel_distfile,
+            patches=patches, sha512sums=checksums))
+
+        if category != "device/testing":
+            self.maintained += [device_dir, kernel_dir]
+
+    def codeowners(self):
+        lines = ["# Synthetic CODEOWNERS, see synthetic_tree.py", ""]
+        for package_dir in sorted(self.maintained):
+            lines.append(f"{package_dir}/\t{' '.join(maintainers)}")
+        write(f"{self.path}/CODEOWNERS", "\n".join(lines) + "\n")
+
+    def generate(self):
+        pmaports_dir = common.get_pmaports_dir()
+        os.makedirs(self.path)
+        for name in ["pmaports.cfg", "channels.cfg", "kconfigcheck.toml"]:
+            shutil.copy(f"{pmaports_dir}/{name}", f"{self.path}/{name}")
+        shutil.copytree(f"{pmaports_dir}/.ci", f"{self.path}/.ci",
+                        symlinks=True,
+                        ignore=shutil.ignore_patterns("__pycache__"))
+
+        self.postmarketos_base()
+        for number in range(1, self.generic + 1):
+            self.generic_package(number)
+
+        for number in range(self.shared_patches):
+            write(f"{self.path}/device/.shared-patches/linux/"
+                  f"{number:04}-synthetic.patch", self.shared_patch(number))
+
+        categories = []
+        for category, share in device_categories.items():
+            categories += [category] * round(share * 100)
+        for number in range(1, self.devices + 1):
+            self.device(number, categories[number % len(categories)])
+
+        self.codeowners()
+
+    def init_git(self, changed):
+        """ Commit the tree as master of the "upstream" remote, then commit
+            changes of some packages on a new branch.
+
+            :param changed: amount of generic packages to change """
+        run_git(self.path, ["init", "-q", "-b", "master"])
+        run_git(self.path, ["config", "user.email", "synthetic@example.org"])
+        run_git(self.path, ["config", "user.name", "Synthetic"])
+        run_git(self.path, ["add", "-A"])
+        run_git(self.path, ["commit", "-q", "-m", "synthetic tree"])
+
+        upstream = f"{self.path}.upstream.git"
+        subprocess.run(["git", "clone", "-q", "--bare", self.path, upstream],
+                       check=True)
+        run_git(self.path, ["remote", "add", "upstream", upstream])
+        run_git(self.path, ["fetch", "-q", "upstream"])
+        run_git(self.path, ["checkout", "-q", "-b", "synthetic-change"])
+
+        for number in self.random.sample(range(1, self.generic + 1),
+                                         min(changed, self.generic)):
+            self.generic_package(number, pkgrel=1)
+        if self.shared_patches:
+            write(f"{self.path}/device/.shared-patches/linux/"
+                  "0000-synthetic.patch", self.shared_patch(0) + "\n")
+        run_git(self.path, ["add", "-A"])
+        run_git(self.path, ["commit", "-q", "-m", "synthetic change"])
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=1000,
+                        help="total amount of APKBUILDs (default: 1000)")
+    parser.add_argument("--devices", type=int,
+                        help="amount of devices, each one has a device"
+                        " package and a kernel (default: packages / 4)")
+    parser.add_argument("--shared-patches", type=int, default=50,
+                        help="amount of patches in device/.shared-patches"
+                        " (default: 50)")
+    parser.add_argument("--links", type=int, default=3,
+                        help="shared patches per kernel (default: 3)")
+    parser.add_argument("--changed", type=int, default=10,
+                        help="packages changed in the last commit"
+                        " (default: 10)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("output_dir")
+    return parser
+
+
+def generate(args):
+    """ :param args: parsed arguments, see get_parser()
+        :returns: Generator instance """
+    devices = args.devices
+    if devices is None:
+        devices = args.packages // 4
+    generator = Generator(os.path.abspath(args.output_dir), args.packages,
+                          devices, args.shared_patches, args.links, args.seed)
+    generator.generate()
+    generator.init_git(args.changed)
+    return generator
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    generator = generate(args)
+    print(f"generated: {generator.path} ({generator.generic} generic"
+          f" packages, {generator.devices} devices)")
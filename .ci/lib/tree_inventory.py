@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Inventory of all files in pmaports, collected in one walk over the tree.
+# Checks for the directory structure, file modes and files in packages read
+# from it, instead of walking (and stat'ing) the tree again each time.
+
+import os
+import stat
+
+# Same dir
+import instrumentation
+
+
+class File:
+    """ One entry of the inventory, anything but a directory. """
+
+    def __init__(self, path, package_dir, mode, size, links_to_dir=False):
+        """ :param path: relative path, e.g. "main/hello-world/APKBUILD"
+            :param package_dir: relative path of the package the file belongs
+                                to (closest parent dir with an APKBUILD), or
+                                None
+            :param mode: st_mode from lstat(), so symlinks are not followed
+            :param size: st_size from lstat()
+            :param links_to_dir: True if this is a symlink to a directory """
+        self.path = path
+        self.package_dir = package_dir
+        self.mode = mode
+        self.size = size
+        self.links_to_dir = links_to_dir
+
+    @property
+    def is_symlink(self):
+        return stat.S_ISLNK(self.mode)
+
+    @property
+    def is_regular(self):
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_executable(self):
+        executable_bits = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+        return self.mode & executable_bits != 0
+
+    @property
+    def hidden(self):
+        """ True if the file or one of its parent dirs starts with a dot,
+            e.g. ".ci/pytest.sh" or "device/.shared-patches/..." """
+        return self.path.startswith(".") or "/." in self.path
+
+    @property
+    def in_hidden_dir(self):
+        """ Like hidden, but only looking at the parent dirs """
+        dirname = os.path.dirname(self.path)
+        return dirname.startswith(".") or "/." in dirname
+
+
+class Inventory:
+    """ All files of a pmaports dir (except for .git), with their package and
+        lstat() results. """
+
+    def __init__(self, pmaports_dir):
+        """ :param pmaports_dir: full path to the pmaports dir """
+        self.pmaports_dir = pmaports_dir
+
+        # Relative path => File
+        self.files = {}
+
+        # Relative paths of all dirs (except for the top dir)
+        self.dirs = set()
+
+        # Relative package dir => list of files below it
+        self.files_by_package = {}
+
+        # Relative dirs of all packages, sorted
+        self.package_dirs = []
+
+        # Packages in subdirs of other packages: list of (outer, inner)
+        self.nested_packages = []
+
+        with instrumentation.measure("walk", "tree_inventory.Inventory"):
+            self._walk("", None)
+        self.package_dirs.sort()
+        instrumentation.record("stat", "tree_inventory.Inventory (lstat)", 0,
+                               len(self.files))
+
+    def _walk(self, dirname, package_dir):
+        """ Add all files of a dir to the inventory, then walk its subdirs.
+
+            :param dirname: relative path of the dir ("" for the top dir)
+            :param package_dir: package that the parent dir belongs to """
+        with os.scandir(os.path.join(self.pmaports_dir, dirname)) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+
+        if any(entry.name == "APKBUILD" for entry in entries):
+            if package_dir:
+                self.nested_packages.append((package_dir, dirname))
+            package_dir = dirname
+            self.package_dirs.append(package_dir)
+            self.files_by_package[package_dir] = []
+
+        subdirs = []
+        for entry in entries:
+            path = os.path.join(dirname, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                if path != ".git":
+                    self.dirs.add(path)
+                    subdirs.append(path)
+                continue
+
+            st = entry.stat(follow_symlinks=False)
+            links_to_dir = stat.S_ISLNK(st.st_mode) and entry.is_dir()
+            file = File(path, package_dir, st.st_mode, st.st_size,
+                        links_to_dir)
+            self.files[path] = file
+            if package_dir:
+                self.files_by_package[package_dir].append(file)
+
+        for subdir in subdirs:
+            self._walk(subdir, package_dir)
+
+    def package_files(self, package_dir, hidden=False):
+        """ :param package_dir: relative package dir, e.g. "main/hello-world"
+            :param hidden: include files in hidden dirs or with hidden names
+                           below the package dir
+            :returns: list of files below the package dir (also in
+                      subdirs) """
+        ret = self.files_by_package.get(package_dir, [])
+        if hidden:
+            return ret
+        prefix_len = len(package_dir) + 1
+        return [file for file in ret
+                if not file.path[prefix_len:].startswith(".")
+                and "/." not in file.path[prefix_len:]]
+
+    def exists(self, path):
+        """ :param path: relative path to a file or dir
+            :returns: True if it is in the inventory """
+        return path in self.files or path.rstrip("/") in self.dirs
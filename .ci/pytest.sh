@@ -43,5 +43,8 @@ if ! [ -e $deviceinfo ]; then
 	exit 1
 fi
 
+# Run checks on packages and devices with all CPU cores
+export PMAPORTS_CI_JOBS="${PMAPORTS_CI_JOBS:-auto}"
+
 # Run testcases
 pytest -vv -x --tb=native "$pmaports/.ci/testcases" "$@"
@@ -8,18 +8,189 @@ import pytest
 import sys
 import os
 
+# Make modules from .ci/lib importable in the testcases
+sys.path.insert(0, os.path.realpath(f"{os.path.dirname(__file__)}/../lib"))
+import apkbuild_index
+import common
+import distfiles_index
+import instrumentation
+import tree_inventory
+import parallel
+import persistent_cache
+import provides_map
+import revdep_index
+import rule_engine
 
-@pytest.fixture
-def args(request):
-    # Initialize args
-    pmaports = os.path.realpath(f"{os.path.dirname(__file__)}/../..")
+pmaports = os.path.realpath(f"{os.path.dirname(__file__)}/../..")
+
+
+def pytest_addoption(parser):
+    parser.addoption("--jobs", default=None,
+                     help="worker processes for checks that run on each"
+                     " package or device ('auto': one per CPU core,"
+                     " default: $PMAPORTS_CI_JOBS or 1)")
+    parser.addoption("--incremental", action="store_true",
+                     default=bool(os.environ.get("PMAPORTS_CI_INCREMENTAL")),
+                     help="only run per-package checks on packages changed"
+                     " compared to the upstream branch and packages that"
+                     " depend on them (default: set if"
+                     " $PMAPORTS_CI_INCREMENTAL is not empty)")
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_setup(item):
+    # Attribute the measurements of the instrumentation (see
+    # instrumentation.py) to the testcase and its phases
+    instrumentation.set_test(item.nodeid)
+    with instrumentation.phase("setup"):
+        yield
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    with instrumentation.phase("call"):
+        yield
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_teardown(item):
+    with instrumentation.phase("teardown"):
+        yield
+    instrumentation.set_test(None)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_fixture_setup(fixturedef):
+    with instrumentation.phase(f"fixture:{fixturedef.argname}"):
+        yield
+
+
+def pytest_terminal_summary(terminalreporter):
+    instrumentation.finish(terminalreporter.write_line)
+
+
+def init_args():
     sys.argv = ["pmbootstrap",
                 "--aports", pmaports,
                 "--log", "$WORK/log_testsuite_pmaports.txt"
                 "chroot"]
-    args = pmb.parse.arguments()
+    return pmb.parse.arguments()
+
+
+@pytest.fixture
+def args(request):
+    # Initialize args
+    args = init_args()
 
     # Initialize logging
     pmb.helpers.logging.init(args)
     request.addfinalizer(pmb.helpers.logging.logfd.close)
     return args
+
+
+@pytest.fixture(scope="session")
+def session_args(request):
+    """ Like args, for fixtures that are shared by all testcases. """
+    args = init_args()
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(pmb.helpers.logging.logfd.close)
+    return args
+
+
+@pytest.fixture(scope="session")
+def parse_cache(request):
+    """ Parse results that persist between pytest runs, stored in the
+        pmbootstrap work dir. Set PMAPORTS_CI_CACHE to use another path, or
+        to an empty string to disable the cache. """
+    path = os.environ.get("PMAPORTS_CI_CACHE")
+    if path is None:
+        path = f"{init_args().work}/cache_pmaports_ci/parse_cache.sqlite"
+    if not path:
+        return None
+
+    ret = persistent_cache.ParseCache(path)
+    request.addfinalizer(ret.close)
+    return ret
+
+
+@pytest.fixture(scope="session")
+def jobs(request):
+    """ Amount of worker processes, see parallel.get_jobs(). """
+    return parallel.get_jobs(request.config.getoption("--jobs"))
+
+
+def get_incremental_package_dirs():
+    """ Get the packages to check in incremental mode.
+
+        :returns: set of relative package dirs (changed packages, without
+                  their reverse dependencies), or None if files outside of
+                  packages were changed and all packages need to be checked
+    """
+    common.add_upstream_git_remote()
+    files = common.get_changed_files()
+    symlinked = common.get_symlinked_package_dirs(files)
+    ret = set()
+    for file in files:
+        package_dir = common.get_package_dir(file)
+        if not package_dir and file in symlinked:
+            # E.g. device/.shared-patches/, check the packages linking to it
+            ret |= symlinked[file]
+            continue
+        if not package_dir:
+            # E.g. .ci/, root files, deleted packages
+            print(f"incremental: {file} is not part of a package, checking"
+                  " all packages")
+            return None
+        ret.add(package_dir)
+    return ret
+
+
+@pytest.fixture(scope="session")
+def inventory():
+    """ All files in pmaports with their package and file mode, collected in
+        one walk over the tree. """
+    return tree_inventory.Inventory(pmaports)
+
+
+@pytest.fixture(scope="session")
+def apkbuilds(request, parse_cache, jobs):
+    """ Index of all APKBUILDs, shared between all testcases so each APKBUILD
+        only gets parsed once per pytest run. In incremental mode, select()
+        and iter() only return the changed packages and their direct reverse
+        dependencies. """
+    ret = apkbuild_index.ApkbuildIndex(pmaports, parse_cache)
+    if jobs > 1:
+        ret.parse_all(jobs)
+
+    if request.config.getoption("--incremental"):
+        package_dirs = get_incremental_package_dirs()
+        if package_dirs is not None:
+            revdeps = revdep_index.ReverseDependencyIndex(ret.get_all())
+            package_dirs |= revdeps.get_direct(package_dirs)
+            print(f"incremental: checking {len(package_dirs)} package(s)")
+            ret.restrict(package_dirs)
+    return ret
+
+
+@pytest.fixture(scope="session")
+def distfiles(apkbuilds, inventory):
+    """ Remote source files of all packages with their checksums (not
+        restricted in incremental mode). """
+    return distfiles_index.DistfilesIndex(apkbuilds, inventory)
+
+
+@pytest.fixture(scope="session")
+def provides_maps(session_args, apkbuilds):
+    """ Installable names for each supported arch, from all APKBUILDs and
+        the APKINDEX files (see provides_map.py). """
+    arches = pmb.config.pmaports.read_config(session_args)["supported_arches"]
+    return provides_map.build(session_args, apkbuilds.get_all(),
+                              arches.split(","))
+
+
+@pytest.fixture(scope="session")
+def lint_results(session_args, apkbuilds, inventory, jobs):
+    """ Results of all rules that the testcases registered with
+        @rule_engine.rule(), from one traversal of the tree. """
+    context = rule_engine.Context(session_args, apkbuilds, inventory)
+    return rule_engine.run(context, jobs)
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+# Copyright 2024 Oliver Smith
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import provides_map
+
+
+def test_dependencies_resolvable(apkbuilds, provides_maps):
+    """
+    Every depends, makedepends and _pmb_recommends entry of each package and
+    subpackage must be installable on all arches the package supports.
+    """
+    errors = []
+    for path, apkbuild in apkbuilds.iter():
+        for error in provides_map.find_unresolvable(apkbuild, provides_maps):
+            errors.append(provides_map.format_error(path, *error))
+
+    if errors:
+        for error in errors:
+            print(error)
+        print(f"unresolvable dependency count: {len(errors)}")
+        raise RuntimeError(errors[-1])
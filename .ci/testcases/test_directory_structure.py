@@ -1,8 +1,7 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: GPL-3.0-or-later
-import glob
+import fnmatch
 import os
-import stat
 
 expected_directories = [
     "cross",
@@ -20,24 +19,29 @@ expected_directories = [
 
 # pmbootstrap allows placing APKBUILDs in arbitrarily nested directories.
 # This test makes sure all of them are in one of the expected locations.
-def test_directories():
-    apkbuilds = set(glob.iglob("**/APKBUILD", recursive=True))
-    expected = set(f for d in expected_directories for f in glob.iglob(d + "/*/APKBUILD"))
-    assert apkbuilds == expected, "Found APKBUILD in unexpected directory. " \
-        "Note that we moved firmware/* to device/{main,community,testing}/*."
+def test_directories(inventory):
+    for package_dir in inventory.package_dirs:
+        if package_dir.startswith(".") or "/." in package_dir:
+            continue
+        assert os.path.dirname(package_dir) in expected_directories, \
+            f"Found APKBUILD in unexpected directory: {package_dir}. " \
+            "Note that we moved firmware/* to device/{main,community,testing}/*."
 
 
 # Ensure no file in pmaports are executable.
 # see https://gitlab.com/postmarketOS/pmaports/-/issues/593.
-def test_executable_files():
-    for file in glob.iglob("[!temp]**/**/*", recursive=True):
-        if os.path.isdir(file) or os.path.islink(file):
+def test_executable_files(inventory):
+    for file in inventory.files.values():
+        # Same selection as the glob "[!temp]**/**/*" used before: not in the
+        # root dir, not hidden, top level dir not starting with t, e, m or p
+        if "/" not in file.path or file.hidden or \
+                not fnmatch.fnmatch(file.path.split("/", 1)[0], "[!temp]*"):
+            continue
+        if file.is_symlink:
             continue
             # still check other less common inode types
-        permissions = os.stat(file).st_mode
-        executable_bits = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
-        if permissions & executable_bits != 0:
-            raise RuntimeError(f"\"{file}\" is executable. Files in pmaports" +
+        if file.is_executable:
+            raise RuntimeError(f"\"{file.path}\" is executable. Files in pmaports" +
                                " should not be executables. post-* files" +
                                " don't need to be executable and executables" +
                                " should be installed using `install -D" +
@@ -48,25 +52,27 @@ def test_executable_files():
 #  - in root directory (README.md)
 #  - hidden (.ci/, device/.shared-patches/)
 #  - or belong to a package (below a directory with APKBUILD)
-def test_files_belong_to_package():
-    # Walk directories and set package_dir when we find an APKBUILD
-    # This allows matching files in subdirectories to the package directory.
-    package_dir = None
-    for dirpath, dirs, files in os.walk("."):
-        # Skip "hidden" directories
-        dirs[:] = [d for d in dirs if not d.startswith(".")]
-        # Ignore files in root directory
-        if dirpath == '.':
+def test_files_belong_to_package(inventory):
+    # Skip "hidden" directories
+    nested = [(outer, inner) for outer, inner in inventory.nested_packages
+              if not inner.startswith(".") and "/." not in inner]
+    assert not nested, f"Nested packages: {nested[0][0]} and {nested[0][1]} " \
+        "both contain an APKBUILD"
+
+    for file in inventory.files.values():
+        # Ignore files in root directory, "hidden" directories and symlinks to
+        # directories
+        if "/" not in file.path or file.in_hidden_dir or file.links_to_dir:
             continue
 
-        # Switched to another directory?
-        if package_dir and not dirpath.startswith(package_dir + os.sep):
-            package_dir = None
+        assert file.package_dir, "Found files that do not belong to any package: " \
+            f"{file.path}"
 
-        if 'APKBUILD' in files:
-            assert not package_dir, f"Nested packages: {package_dir} and {dirpath} " \
-                "both contain an APKBUILD"
-            package_dir = dirpath
 
-        assert not files or package_dir, "Found files that do not belong to any package: " \
-            f"{dirpath}/{files}"
+# Checks that use ApkbuildIndex.get_all() skip APKBUILDs that fail to parse,
+# so report them here.
+def test_apkbuilds_parse(apkbuilds):
+    apkbuilds.get_all()
+    errors = [f"{package_dir}: {error}"
+              for package_dir, error in sorted(apkbuilds.errors.items())]
+    assert not errors, "Failed to parse APKBUILDs:\n" + "\n".join(errors)
@@ -16,10 +16,48 @@ import add_pmbootstrap_to_import_path
 import pmb.config
 import pmb.parse
 
+import rule_engine
 
-def get_categorized_packages(args):
+
+# Only packages directly below the top level dirs (not device/*/*). Not
+# restricted in incremental mode, versions are compared across packages.
+@rule_engine.rule("package", ["*"], restricted=False)
+def framework_version(context, package):
     """
-    Parse all aports and categorize them.
+    Categorize one package.
+
+    :returns: [(category, pkgname, pkgver)], e.g. [("kde", "kcrash",
+              "5.48.0")]. Empty list for packages with a git version.
+    """
+    apkbuild = package.apkbuild
+    url = apkbuild["url"]
+    pkgname = apkbuild["pkgname"]
+    pkgver = apkbuild["pkgver"]
+    if pkgver == "9999":
+        pkgver = apkbuild["_pkgver"]
+
+    if "_git" in pkgver:
+        return []
+
+    # Categorize by URL
+    category = "other"
+    if "https://www.kde.org/workspaces/plasmadesktop" in url:
+        category = "plasma"
+    elif "https://community.kde.org/Frameworks" in url:
+        category = "kde"
+    elif url in ["http://qt-project.org/",
+                 "https://www.qt.io/developers/"]:
+        category = "qt"
+
+    # Remove hotfix number (i.e. 5.16.90.1 becomes 5.16.90)
+    if category in ["kde", "plasma"]:
+        pkgver = ".".join(pkgver.split(".")[0:3])
+    return [(category, pkgname, pkgver)]
+
+
+def get_categorized_packages(lint_results):
+    """
+    Collect the results of framework_version().
 
     :returns: {"plasma": {"kwin": "5.13.3", ...},
                "kde": {"kcrash": "5.48.0", ...},
@@ -27,34 +65,7 @@ def get_categorized_packages(args):
                "other": {"konsole": "1234", ...}}
     """
     ret = {}
-
-    for path in glob.glob(args.aports + "/*/*/APKBUILD"):
-        # Parse APKBUILD
-        apkbuild = pmb.parse.apkbuild(path)
-        url = apkbuild["url"]
-        pkgname = apkbuild["pkgname"]
-        pkgver = apkbuild["pkgver"]
-        if pkgver == "9999":
-            pkgver = apkbuild["_pkgver"]
-
-        if "_git" in pkgver:
-            continue
-
-        # Categorize by URL
-        category = "other"
-        if "https://www.kde.org/workspaces/plasmadesktop" in url:
-            category = "plasma"
-        elif "https://community.kde.org/Frameworks" in url:
-            category = "kde"
-        elif url in ["http://qt-project.org/",
-                     "https://www.qt.io/developers/"]:
-            category = "qt"
-
-        # Remove hotfix number (i.e. 5.16.90.1 becomes 5.16.90)
-        if category in ["kde", "plasma"]:
-            pkgver = ".".join(pkgver.split(".")[0:3])
-
-        # Save result
+    for category, pkgname, pkgver in lint_results.get("framework_version"):
         if category not in ret:
             ret[category] = {}
         ret[category][pkgname] = pkgver
@@ -109,10 +120,10 @@ def check_categories(categories):
     return ret
 
 
-def test_framework_versions(args):
+def test_framework_versions(lint_results):
     """
     Make sure that packages of the same framework have the same version.
     """
-    categories = get_categorized_packages(args)
+    categories = get_categorized_packages(lint_results)
     if not check_categories(categories):
         raise RuntimeError("Framework version check failed!")
@@ -11,6 +11,8 @@ import add_pmbootstrap_to_import_path
 import pmb.parse
 import pmb.parse._apkbuild
 
+import rule_engine
+
 
 def apkbuild_check_provides(path, apkbuild, version, pkgname, subpkgname=None):
     """
@@ -65,23 +67,34 @@ def apkbuild_check_provides(path, apkbuild, version, pkgname, subpkgname=None):
     return ret
 
 
-def test_provides(args):
-    errors = []
-    for path in glob.iglob(f"{args.aports}/**/APKBUILD", recursive=True):
-        apkbuild = pmb.parse.apkbuild(path)
-        pkgname = apkbuild["pkgname"]
-        version = f"{apkbuild['pkgver']}-r{apkbuild['pkgrel']}"
-        path_rel = os.path.relpath(path, args.aports)
-        errors += apkbuild_check_provides(path_rel, apkbuild, version, pkgname)
-
-        for subpkg, subpkg_data in apkbuild["subpackages"].items():
-            if not subpkg_data:
-                # default packaging function like -doc
-                continue
-            errors += apkbuild_check_provides(path_rel, subpkg_data, version,
-                                              pkgname, subpkg)
-
-    if errors:
-        for error in errors:
-            logging.error(error)
-        raise RuntimeError(f"test_provides failed with {len(errors)} errors")
+def get_version(apkbuild):
+    """ :returns: version like 1.0.0-r3 """
+    return f"{apkbuild['pkgver']}-r{apkbuild['pkgrel']}"
+
+
+@rule_engine.rule("package")
+def package_provides(context, package):
+    """
+    Verify provides of one package.
+    """
+    apkbuild = package.apkbuild
+    return apkbuild_check_provides(f"{package.package_dir}/APKBUILD",
+                                   apkbuild, get_version(apkbuild),
+                                   apkbuild["pkgname"])
+
+
+@rule_engine.rule("subpackage")
+def subpackage_provides(context, package, subpkgname, subpackage):
+    """
+    Verify provides of one subpackage (without default packaging functions
+    like -doc).
+    """
+    apkbuild = package.apkbuild
+    return apkbuild_check_provides(f"{package.package_dir}/APKBUILD",
+                                   subpackage, get_version(apkbuild),
+                                   apkbuild["pkgname"], subpkgname)
+
+
+def test_provides(lint_results):
+    lint_results.report("package_provides", "subpackage_provides",
+                        log=logging.error)
@@ -3,7 +3,6 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # Various checks on source= in the APKBUILDs
 
-import glob
 import logging
 import os
 import pytest
@@ -15,66 +14,36 @@ import pmb.parse._apkbuild
 import pmb.parse.apkindex
 import pmb.helpers.repo
 
+import checksums
+import rule_engine
 
-def parse_source_from_checksums(args, apkbuild_path):
-    """
-    Read the APKBUILD file and parse source files from the checksums at the
-    bottom. This has always the same format, even if $source is built with hard
-    to parse shell code (like in postmarketos-base).
-
-    :param apkbuild_path: full path to the APKBUILD
-    :returns: dict of parsed "source" filenames and checksums, e.g.:
-              {"first.patch": "b4dc4f3…",
-               "second.patch": "b4dc4f3…"}
-    """
-    start = 'sha512sums="'
-    in_block = False
-    ret = {}
-
-    with open(apkbuild_path, encoding="utf-8") as handle:
-        for line in handle.readlines():
-            # Find start
-            if not in_block:
-                if line.startswith(start):
-                    in_block = True
-                else:
-                    continue
-
-            # sha512sums may have lines without checksums:
-            # https://gitlab.alpinelinux.org/alpine/abuild/-/merge_requests/73
-            if "  " not in line:
-                continue
-
-            try:
-                checksum, filename = line.rstrip().split("  ", 2)
-            except ValueError:
-                raise ValueError("Failed to parse checksums. Try to delete the"
-                                 " checksums and generate them again with"
-                                 f" 'pmbootstrap checksum': {apkbuild_path}")
-
-            # Cut off 'sha512sums="' if the first checksum is in that line
-            if checksum.startswith(start):
-                checksum = checksum[len(start):]
 
-            # Find end
-            if filename.endswith('"'):
-                filename = filename[:-1]
+def get_sources(package):
+    """
+    Parse the checksums of a package once for all of its files.
 
-            ret[filename] = checksum
-    return ret
+    :param package: rule_engine.Package instance
+    :returns: (sources, error): dict of source filenames and checksums (see
+              checksums.parse_source_from_checksums()), the ValueError if the
+              checksums can't be parsed
+    """
+    if "sources" not in package.memo:
+        try:
+            sources = checksums.parse_source_from_checksums(package.path)
+            package.memo["sources"] = (sources, None)
+        except ValueError as e:
+            package.memo["sources"] = ({}, e)
+    return package.memo["sources"]
 
 
-def test_aports_unreferenced_files(args):
+def get_referenced_files(package):
     """
-    Raise an error if an unreferenced file is found
+    :param package: rule_engine.Package instance
+    :returns: set of files that are referenced as install or trigger files of
+              the package and its subpackages, relative to the package dir
     """
-    for apkbuild_path in glob.iglob(args.aports + "/**/APKBUILD", recursive=True):
-        # pmbootstrap parser has some issues with complicated APKBUILDs, skip those.
-        if apkbuild_path.startswith(args.aports + "/cross/"):
-            continue
-
-        apkbuild = pmb.parse.apkbuild(apkbuild_path)
-        sources_chk = parse_source_from_checksums(args, apkbuild_path)
+    if "referenced" not in package.memo:
+        apkbuild = package.apkbuild
 
         # Collect files from subpackages
         subpackage_installs = []
@@ -91,21 +60,44 @@ def test_aports_unreferenced_files(args):
         for trigger in apkbuild["triggers"] + subpackage_triggers:
             trigger_sources.append(trigger.split("=")[0])
 
-        dirname = os.path.dirname(apkbuild_path)
-        for file in glob.iglob(dirname + "/**", recursive=True):
-            rel_file_path = os.path.relpath(file, dirname)
-            # Skip APKBUILDs and directories
-            if rel_file_path == "APKBUILD" or os.path.isdir(file):
-                continue
+        package.memo["referenced"] = set(apkbuild["install"] +
+                                         subpackage_installs +
+                                         trigger_sources)
+    return package.memo["referenced"]
+
 
-            if os.path.basename(rel_file_path) not in sources_chk \
-                    and rel_file_path not in apkbuild["install"] \
-                    and rel_file_path not in subpackage_installs \
-                    and rel_file_path not in trigger_sources:
-                raise RuntimeError(f"{apkbuild_path}: found unreferenced file: {rel_file_path}")
+# pmbootstrap parser has some issues with complicated APKBUILDs, skip those.
+@rule_engine.rule("file", exclude=["cross"])
+def unreferenced_file(context, package, file):
+    """
+    :returns: list with an error string if the file is not referenced
+    """
+    rel_file_path = os.path.relpath(file.path, package.package_dir)
+    sources_chk, error = get_sources(package)
+
+    # Report broken checksums once per package, with the APKBUILD
+    if rel_file_path == "APKBUILD":
+        return [str(error)] if error else []
+
+    # Skip symlinks to directories, and the other files of packages with
+    # broken checksums
+    if file.links_to_dir or error:
+        return []
+
+    if os.path.basename(rel_file_path) not in sources_chk \
+            and rel_file_path not in get_referenced_files(package):
+        return [f"{package.path}: found unreferenced file: {rel_file_path}"]
+    return []
+
+
+def test_aports_unreferenced_files(lint_results):
+    """
+    Raise an error if an unreferenced file is found
+    """
+    lint_results.report("unreferenced_file", log=logging.error)
 
 
-def test_distfiles_conflict(args):
+def test_distfiles_conflict(distfiles):
     """
     Make sure that each filename mentioned in any source= of any APKBUILD
     always has the same checksum. This is important because apk caches
@@ -114,39 +106,19 @@ def test_distfiles_conflict(args):
     user builds both after each other, abuild will fail on the second build
     with a checksum error.
     """
-    source_all = {}
-    for apkbuild_path in glob.iglob(f"{args.aports}/**/APKBUILD", recursive=True):
-        source = parse_source_from_checksums(args, apkbuild_path)
-        dir_path = os.path.dirname(apkbuild_path)
-        apkbuild_rel = os.path.relpath(apkbuild_path, args.aports)
-        for filename, checksum in source.items():
-            # Files bundled with the APKBUILD don't get copied to the distfiles
-            # cache, so not relevant for this check. Use glob.glob here and not
-            # iglob, because we don't want an iterator.
-            if glob.glob(f"{dir_path}/**/{filename}", recursive=True):
-                continue
-
-            # First time seeing this file
-            if filename not in source_all:
-                source_all[filename] = {"checksum": checksum,
-                                        "apkbuild_rel": apkbuild_rel}
-                continue
-
-            # Saw this file already with same checksum
-            if checksum == source_all[filename]["checksum"]:
-                continue
-
-            # Saw this file already with different checksum
-            logging.error("")
-            logging.error(f"ERROR: the source file '{filename}' has different"
-                          " checksums in the following files:")
-            logging.error(f"- {source_all[filename]['apkbuild_rel']}:")
-            logging.error(f"  {source_all[filename]['checksum']}")
-            logging.error(f"- {apkbuild_rel}:")
-            logging.error(f"  {checksum}")
-            logging.error("")
-            logging.error("Fix this by setting a different target filename in"
-                          " the package you modified:")
-            logging.error("https://wiki.alpinelinux.org/wiki/APKBUILD_Reference#source")
-            logging.error("")
-            raise RuntimeError(f"Conflict with source file '{filename}'")
+    if not distfiles.conflicts:
+        return
+
+    filename, first, other = distfiles.conflicts[0]
+    logging.error("")
+    logging.error(f"ERROR: the source file '{filename}' has different"
+                  " checksums in the following files:")
+    for checksum, apkbuild_rel in [first, other]:
+        logging.error(f"- {apkbuild_rel}:")
+        logging.error(f"  {checksum}")
+    logging.error("")
+    logging.error("Fix this by setting a different target filename in"
+                  " the package you modified:")
+    logging.error("https://wiki.alpinelinux.org/wiki/APKBUILD_Reference#source")
+    logging.error("")
+    raise RuntimeError(f"Conflict with source file '{filename}'")
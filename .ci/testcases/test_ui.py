@@ -2,41 +2,21 @@
 # Copyright 2021 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import glob
-import pytest
-import sys
-import os
+import provides_map
 
-import add_pmbootstrap_to_import_path
-import pmb.parse
 
-
-def test_aports_ui(args):
+def test_aports_ui(apkbuilds, provides_maps):
     """
     Raise an error if package in _pmb_recommends is not found
     """
-    pmaports_cfg = pmb.config.pmaports.read_config(args)
-
-    for arch in pmaports_cfg["supported_arches"].split(","):
-        for path in glob.iglob(args.aports + "/main/postmarketos-ui-*/APKBUILD"):
-            apkbuild = pmb.parse.apkbuild(path)
-            # Skip if arch isn't enabled
-            if not pmb.helpers.package.check_arch(args, apkbuild["pkgname"], arch, False):
-                continue
-
-            for package in apkbuild["_pmb_recommends"]:
-                depend = pmb.helpers.package.get(args, package,
-                                                 arch, must_exist=False)
-                if depend is None or not pmb.helpers.package.check_arch(args, package, arch):
-                    raise RuntimeError(f"{path}: package '{package}' from"
-                                       f" _pmb_recommends not found for arch '{arch}'")
+    errors = []
+    for path, apkbuild in apkbuilds.iter("main", "postmarketos-ui-"):
+        # Includes the -extras subpackage if one exists
+        for error in provides_map.find_unresolvable(apkbuild, provides_maps,
+                                                    ["_pmb_recommends"]):
+            errors.append(provides_map.format_error(path, *error))
 
-            # Check packages from "_pmb_recommends" of -extras subpackage if one exists
-            if f"{apkbuild['pkgname']}-extras" in apkbuild["subpackages"]:
-                apkbuild = apkbuild["subpackages"][f"{apkbuild['pkgname']}-extras"]
-                for package in apkbuild["_pmb_recommends"]:
-                    depend = pmb.helpers.package.get(args, package,
-                                                     arch, must_exist=False)
-                    if depend is None or not pmb.helpers.package.check_arch(args, package, arch):
-                        raise RuntimeError(f"{path}: package '{package}' from _pmb_recommends "
-                                           f"of -extras subpackage is not found for arch '{arch}'")
+    if errors:
+        for error in errors:
+            print(error)
+        raise RuntimeError(errors[-1])